@@ -0,0 +1,289 @@
+import asyncio
+import json
+import time
+
+from pylon.core.tools import log
+
+from . import metrics, runtime
+from .clients import client_registry
+from .descriptors import unsecret
+from .endpoints import endpoint_pool
+from .models.integration_pd import IntegrationModel
+from .retry import call_with_retry
+from .usage_ledger import usage_ledger
+from .utils import chat_params, chat_request_params, completion_request_params, prepare_result, text_params
+
+
+URLS = {
+    'chat': '/v1/chat/completions',
+    'text': '/v1/completions',
+}
+AZURE_URLS = {
+    'chat': '/chat/completions',
+    'text': '/completions',
+}
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+def batch_url(endpoint, kind: str) -> str:
+    """ Azure batch lines and jobs address deployments without the /v1 prefix """
+    return (AZURE_URLS if endpoint.api_type == 'azure' else URLS)[kind]
+
+
+class OpenAIBatchTransport:
+    """ Files and Batches API over the pooled client of one endpoint, swap for a stub in tests """
+
+    def __init__(self, endpoint, api_key: str, max_retries: int = 3, deadline: float = 60.0):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.deadline = deadline
+
+    async def _call(self, func, label: str):
+        async def attempt():
+            async with client_registry.client(self.endpoint, self.api_key) as client:
+                return await func(client)
+        return await call_with_retry(attempt, self.max_retries, self.deadline, label=f'batch {label}')
+
+    async def upload(self, content: bytes) -> str:
+        file = await self._call(
+            lambda client: client.files.create(file=('batch.jsonl', content), purpose='batch'), 'upload'
+        )
+        return file.id
+
+    async def create(self, input_file_id: str, url: str, completion_window: str, metadata: dict | None) -> dict:
+        batch = await self._call(
+            lambda client: client.batches.create(
+                input_file_id=input_file_id, endpoint=url, completion_window=completion_window,
+                metadata=metadata,
+            ),
+            'create',
+        )
+        return batch.model_dump()
+
+    async def retrieve(self, batch_id: str) -> dict:
+        batch = await self._call(lambda client: client.batches.retrieve(batch_id), 'retrieve')
+        return batch.model_dump()
+
+    async def download(self, file_id: str) -> bytes:
+        content = await self._call(lambda client: client.files.content(file_id), 'download')
+        return content.content
+
+    async def cancel(self, batch_id: str) -> dict:
+        batch = await self._call(lambda client: client.batches.cancel(batch_id), 'cancel')
+        return batch.model_dump()
+
+
+def build_requests(settings: IntegrationModel, items: list, mode: str) -> tuple:
+    """
+    (kind, [params or the error building them]) for prompt_structs (mode='predict') or request bodies
+    (mode='chat_completion' / 'completion'), using the same trimming as the per-call RPCs
+    """
+    if mode == 'predict':
+        model = settings.model
+        if model is not None and model.supports('chat_completion'):
+            kind, build = 'chat', chat_params
+        elif model is not None and model.supports('completion'):
+            kind, build = 'text', text_params
+        else:
+            raise ValueError(f'Model {settings.model_name} does not support chat or text completion')
+    elif mode == 'chat_completion':
+        kind, build = 'chat', chat_request_params
+    elif mode == 'completion':
+        kind, build = 'text', completion_request_params
+    else:
+        raise ValueError(f'Unknown batch mode: {mode}')
+    requests = []
+    for item in items:
+        try:
+            requests.append(build(settings, item))
+        except Exception as e:  # pylint: disable=W0703
+            requests.append(e)
+    return kind, requests
+
+
+class BatchJob:
+    def __init__(self, project_id: int, integration: str, endpoint, mode: str, kind: str, custom_ids: list):
+        self.id = None
+        self.project_id = project_id
+        self.integration = integration
+        self.endpoint = endpoint
+        self.mode = mode
+        self.kind = kind
+        self.custom_ids = custom_ids
+        self.status = 'submitting'
+        self.batch = {}
+        self.results = {}
+        self.ordered = []
+        self.error = None
+        self.finished_at = None
+        self.transport = None
+        self.task = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def result(self, custom_id: str, line: dict) -> dict:
+        response = line.get('response') or {}
+        body = response.get('body') or {}
+        if line.get('error') or response.get('status_code') != 200:
+            return {
+                'custom_id': custom_id, 'ok': False,
+                'error': line.get('error') or body.get('error') or f"status {response.get('status_code')}",
+            }
+        model = body.get('model') or ''
+        metrics.record_usage(self.project_id, model, body.get('usage'))
+        usage_ledger.record(self.project_id, model, self.integration, body.get('usage'))
+        if self.mode == 'predict':
+            choice = body['choices'][0]
+            content = choice['message']['content'] if self.kind == 'chat' else choice['text']
+            return {'custom_id': custom_id, 'ok': True, 'response': prepare_result(content)}
+        return {'custom_id': custom_id, 'ok': True, 'response': body}
+
+    def stats(self) -> dict:
+        return {
+            'batch_id': self.id,
+            'status': self.status,
+            'request_counts': self.batch.get('request_counts'),
+            'results_ready': len(self.ordered),
+            'total': len(self.custom_ids),
+            'error': self.error,
+        }
+
+
+class BatchJobs:
+    """
+    Submitted batches polled on the shared loop, results kept until `retention` after they finish.
+    Jobs live in this process only: after a restart their batches keep running upstream
+    but are no longer polled, and their ids are unknown here
+    """
+
+    def __init__(self, transport=OpenAIBatchTransport, poll_interval: float = 30.0, retention: float = 86400.0):
+        self.transport = transport
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._jobs = {}
+
+    def configure(self, poll_interval: float | None = None, retention: float | None = None):
+        if poll_interval is not None:
+            self.poll_interval = poll_interval
+        if retention is not None:
+            self.retention = retention
+
+    def _evict(self):
+        now = time.monotonic()
+        for batch_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.retention:
+                del self._jobs[batch_id]
+                job.task.cancel()
+
+    def get(self, project_id: int, batch_id: str) -> BatchJob:
+        """ Job of the project, batches of other projects are reported as unknown """
+        self._evict()
+        job = self._jobs.get(batch_id)
+        if job is None or str(job.project_id) != str(project_id):
+            raise KeyError(f'Unknown batch: {batch_id}')
+        return job
+
+    async def submit(
+            self, project_id: int, settings: IntegrationModel, endpoint, api_key: str, mode: str, kind: str,
+            requests: list, custom_ids: list, completion_window: str = '24h', metadata: dict | None = None
+            ) -> BatchJob:
+        job = BatchJob(project_id, settings.api_base, endpoint, mode, kind, custom_ids)
+        url = batch_url(endpoint, kind)
+        lines = []
+        for custom_id, params in zip(custom_ids, requests):
+            if isinstance(params, Exception):
+                job.results[custom_id] = {'custom_id': custom_id, 'ok': False, 'error': str(params)}
+                continue
+            lines.append(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': url, 'body': params}))
+        if not lines:
+            raise ValueError('No valid requests in batch')
+        job.transport = self.transport(job.endpoint, api_key, settings.max_retries, settings.retry_deadline)
+        file_id = await job.transport.upload('\n'.join(lines).encode())
+        job.batch = await job.transport.create(file_id, url, completion_window, metadata)
+        job.id = job.batch['id']
+        job.status = job.batch['status']
+        self._jobs[job.id] = job
+        job.task = asyncio.ensure_future(self._poll(job))
+        log.info('Submitted batch %s with %s requests', job.id, len(lines))
+        return job
+
+    async def _poll(self, job: BatchJob):
+        try:
+            while job.status not in TERMINAL_STATUSES:
+                await asyncio.sleep(self.poll_interval)
+                job.batch = await job.transport.retrieve(job.id)
+                job.status = job.batch['status']
+            for file_id in (job.batch.get('output_file_id'), job.batch.get('error_file_id')):
+                if file_id:
+                    content = await job.transport.download(file_id)
+                    for line in content.decode().splitlines():
+                        if line.strip():
+                            line = json.loads(line)
+                            job.results[line['custom_id']] = job.result(line['custom_id'], line)
+            if job.batch.get('errors'):
+                job.error = job.batch['errors']
+        except Exception as e:  # pylint: disable=W0703
+            log.error('Batch %s polling failed: %s', job.id, e)
+            job.error = str(e)
+        job.ordered = [job.results[custom_id] for custom_id in job.custom_ids if custom_id in job.results]
+        job.finished_at = time.monotonic()
+        log.info('Batch %s finished with status %s', job.id, job.status)
+
+    def results(self, project_id: int, batch_id: str, cursor: int = 0, limit: int = 1000) -> dict:
+        """ Next page of results in input order, available once the batch has finished """
+        job = self.get(project_id, batch_id)
+        results = job.ordered[cursor:cursor + limit]
+        cursor += len(results)
+        return {
+            'results': results,
+            'cursor': cursor,
+            'done': job.finished and cursor >= len(job.ordered),
+            **job.stats(),
+        }
+
+    async def cancel(self, project_id: int, batch_id: str) -> dict:
+        job = self.get(project_id, batch_id)
+        if not job.finished:
+            job.batch = await job.transport.cancel(batch_id)
+            job.status = job.batch['status']
+        return job.stats()
+
+    async def aclose(self):
+        """ Stop polling, the batches keep running upstream """
+        jobs, self._jobs = self._jobs, {}
+        tasks = [job.task for job in jobs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {batch_id: job.stats() for batch_id, job in list(self._jobs.items())}
+
+
+batch_jobs = BatchJobs()
+
+
+def submit(
+        project_id: int, settings: dict, items: list, mode: str = 'predict', custom_ids: list | None = None,
+        **kwargs
+        ) -> dict:
+    """ Build requests and unsecret the key in the calling thread, either would stall the shared loop """
+    settings = IntegrationModel.parse_cached(settings)
+    custom_ids = [str(custom_id) for custom_id in custom_ids] if custom_ids else \
+        [str(index) for index in range(len(items))]
+    if len(custom_ids) != len(items) or len(set(custom_ids)) != len(custom_ids):
+        raise ValueError('custom_ids must be unique and match items')
+    kind, requests = build_requests(settings, items, mode)
+    endpoint = endpoint_pool.select(settings.endpoint_list, settings.balancing)
+    api_key = unsecret(endpoint.api_token, project_id)
+    job = runtime.run(batch_jobs.submit(
+        project_id, settings, endpoint, api_key, mode, kind, requests, custom_ids, **kwargs
+    ))
+    return job.stats()
+
+
+def cancel(project_id: int, batch_id: str) -> dict:
+    return runtime.run(batch_jobs.cancel(project_id, batch_id))
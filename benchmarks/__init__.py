@@ -0,0 +1 @@
+""" Benchmarks, run as `python -m plugins.open_ai.benchmarks.<name>` from the pylon root """
@@ -0,0 +1,49 @@
+""" Bulk token counting of a streamed corpus: per-text loop against the process pool at several sizes """
+import os
+import random
+import sys
+import time
+
+from ..bulk_tokens import BulkTokenCounter
+from ..utils import get_encoding
+
+
+MODEL_NAME = 'text-embedding-ada-002'
+TEXTS = 1_000_000
+
+
+def corpus(size: int, seed: int = 0):
+    """ Chunk-sized texts generated lazily, the corpus is never held in memory """
+    rnd = random.Random(seed)
+    words = ['token', 'limit', 'context', 'history', 'model', 'assistant', 'prompt', 'reply', 'índice', '文档']
+    for _ in range(size):
+        yield ' '.join(rnd.choice(words) for _ in range(rnd.randint(10, 200)))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else TEXTS
+    encoding = get_encoding(MODEL_NAME)
+
+    started = time.perf_counter()
+    expected = [len(encoding.encode_ordinary(text)) for text in corpus(size)]
+    baseline = time.perf_counter() - started
+    print(f'{size} texts, {sum(expected)} tokens')
+    print(f'{"processes":>9} {"seconds":>8} {"texts/s":>10} {"speedup":>8}')
+    print(f'{"loop":>9} {baseline:>8.2f} {size / baseline:>10.0f} {1:>7.1f}x')
+
+    cores = os.cpu_count() or 1
+    for processes in sorted({1, 2, 4, cores} - {n for n in (2, 4) if n > cores}):
+        counter = BulkTokenCounter(processes=processes)
+        try:
+            counter.count(corpus(3 * counter.chunk_size), MODEL_NAME)  # warm the pool up
+            started = time.perf_counter()
+            counts = counter.count(corpus(size), MODEL_NAME)
+            elapsed = time.perf_counter() - started
+        finally:
+            counter.shutdown()
+        assert counts.tolist() == expected
+        print(f'{processes:>9} {elapsed:>8.2f} {size / elapsed:>10.0f} {baseline / elapsed:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+""" Per-dispatch cost of chat_model_invoke descriptors: compiled templates against the per-call build it replaced """
+import json
+import random
+import time
+from types import SimpleNamespace
+
+from tools import worker_client  # pylint: disable=E0401
+
+from .. import metrics
+from ..methods.callbacks import Method
+
+
+SIZES = (1, 10, 100, 1000)
+REPEATS = 2000
+SETTINGS = {
+    'api_base': 'https://api.openai.com/v1',
+    'api_token': 'sk-benchmark',
+    'model_name': 'gpt-4o',
+    'models': [
+        {'id': name, 'name': name, 'capabilities': {'chat_completion': True}, 'token_limit': 128000}
+        for name in ('gpt-4o', 'gpt-4o-mini', 'gpt-4-turbo', 'gpt-3.5-turbo')
+    ],
+    'max_tokens': 1024,
+    'temperature': 0.2,
+    'top_p': 0.8,
+}
+
+
+@metrics.timed_callback  # both sides pay the same instrumentation
+def legacy_chat_model_invoke(settings, messages):
+    """ chat_model_invoke as it was before templates and load balancing """
+    try:
+        project_id = settings.integration.project_id
+    except AttributeError:
+        project_id = None
+    api_token = worker_client.unsecret_data(settings.merged_settings["api_token"], project_id)
+    model_parameters = {}
+    for param in ["max_tokens", "temperature", "top_p"]:
+        if param in settings.merged_settings:
+            model_parameters[param] = settings.merged_settings[param]
+    return {
+        "routing_key": None,
+        "target": "plugins.open_ai_worker.utils.ai.Helper",
+        "target_args": None,
+        "target_kwargs": {
+            "target_class": "langchain_openai.chat_models.base.ChatOpenAI",
+            "target_args": None,
+            "target_kwargs": {
+                "model": settings.merged_settings["model_name"],
+                **model_parameters,
+                "base_url": settings.merged_settings["api_base"],
+                "api_key": api_token,
+            },
+            "client_attr": None,
+        },
+        "target_io_bound": True,
+        "method": "chat_invoke",
+        "method_args": None,
+        "method_kwargs": {
+            "messages": json.loads(json.dumps(messages)),
+        },
+    }
+
+
+def make_messages(size: int, seed: int = 0) -> list:
+    rnd = random.Random(seed)
+    words = ['token', 'limit', 'context', 'history', 'model', 'assistant', 'prompt', 'reply']
+    return [
+        {
+            'role': 'user' if index % 2 else 'assistant',
+            'content': ' '.join(rnd.choice(words) for _ in range(rnd.randint(5, 120))),
+        }
+        for index in range(size)
+    ]
+
+
+def timed(func, *args) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        func(*args)
+    return (time.perf_counter() - started) / REPEATS
+
+
+def main():
+    settings = SimpleNamespace(integration=SimpleNamespace(project_id=1), merged_settings=SETTINGS)
+    print(f'{"messages":>8} {"legacy us":>10} {"template us":>12} {"speedup":>8}')
+    for size in SIZES:
+        messages = make_messages(size)
+        assert Method.chat_model_invoke(None, settings, messages) == legacy_chat_model_invoke(settings, messages)
+        legacy = timed(legacy_chat_model_invoke, settings, messages)
+        template = timed(Method.chat_model_invoke, None, settings, messages)
+        print(f'{size:>8} {legacy * 1e6:>10.1f} {template * 1e6:>12.1f} {legacy / template:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
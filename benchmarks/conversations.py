@@ -0,0 +1,59 @@
+""" Per-turn cost of a growing chat session: full prepare_conversation against the session store """
+import random
+import time
+
+from ..utils import ConversationStore, prepare_conversation
+
+
+MODEL_NAME = 'gpt-4o'
+TOKEN_LIMIT = 128000
+MAX_RESPONSE_TOKENS = 4096
+TURNS = 2000
+REPORT_EVERY = 250
+
+
+def text(rnd: random.Random) -> str:
+    words = ['token', 'limit', 'context', 'history', 'model', 'assistant', 'prompt', 'reply']
+    return ' '.join(rnd.choice(words) for _ in range(rnd.randint(5, 120)))
+
+
+def main():
+    rnd = random.Random(0)
+    store = ConversationStore()
+    prompt_struct = {
+        'context': text(rnd),
+        'examples': [{'input': text(rnd), 'output': text(rnd)}],
+        'chat_history': [],
+        'conversation_id': 'benchmark',
+    }
+    full_total = session_total = 0.0
+    print(f'{"turn":>6} {"history":>8} {"full ms":>8} {"session ms":>11} {"speedup":>8}')
+    for turn in range(1, TURNS + 1):
+        prompt_struct['prompt'] = text(rnd)
+
+        started = time.perf_counter()
+        expected = prepare_conversation(prompt_struct, MODEL_NAME, MAX_RESPONSE_TOKENS, TOKEN_LIMIT)
+        full = time.perf_counter() - started
+
+        started = time.perf_counter()
+        actual = store.prepare('benchmark', prompt_struct, MODEL_NAME, MAX_RESPONSE_TOKENS, TOKEN_LIMIT)
+        session = time.perf_counter() - started
+
+        assert actual == expected, f'Output mismatch at turn {turn}'
+        full_total += full
+        session_total += session
+        if turn % REPORT_EVERY == 0:
+            print(
+                f'{turn:>6} {len(prompt_struct["chat_history"]):>8} '
+                f'{full * 1000:>8.2f} {session * 1000:>11.3f} {full / session:>7.1f}x'
+            )
+        prompt_struct['chat_history'] = [
+            *prompt_struct['chat_history'],
+            {'role': 'user', 'content': prompt_struct['prompt']},
+            {'role': 'assistant', 'content': text(rnd)},
+        ]
+    print(f'total  {full_total:.2f}s full, {session_total:.2f}s session, {full_total / session_total:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
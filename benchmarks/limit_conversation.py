@@ -0,0 +1,97 @@
+""" Compare prefix-sum conversation trimming against the per-message loop it replaced """
+import random
+import time
+from collections import deque
+
+from ..utils import clear_token_cache, limit_conversation, num_tokens_from_messages
+
+
+MODEL_NAME = 'gpt-4-0613'
+TOKEN_LIMIT = 128000
+MAX_RESPONSE_TOKENS = 4096
+SIZES = (10, 100, 500, 1000, 5000, 10000)
+REPEATS = 5
+
+
+def legacy_limit_conversation(
+        conversation: dict, model_name: str, max_response_tokens: int, token_limit: int
+        ) -> list:
+    limited_conversation = []
+    remaining_tokens = token_limit - max_response_tokens - 3
+    remaining_tokens -= num_tokens_from_messages(conversation['context'], model_name)
+    if remaining_tokens < 0:
+        raise Exception('There are no enough tokens to form messages for ChatCompletion.')
+    limited_conversation.extend(conversation['context'])
+    remaining_tokens -= num_tokens_from_messages(conversation['input'], model_name)
+    if remaining_tokens < 0:
+        return limited_conversation
+    final_examples = []
+    for example in conversation['examples']:
+        remaining_tokens -= num_tokens_from_messages([example], model_name)
+        if remaining_tokens < 0:
+            if len(final_examples) % 2:
+                final_examples.pop()
+            return limited_conversation + final_examples + conversation['input']
+        final_examples.append(example)
+    limited_conversation.extend(final_examples)
+    final_history = deque()
+    for message in reversed(conversation['chat_history']):
+        remaining_tokens -= num_tokens_from_messages([message], model_name)
+        if remaining_tokens < 0:
+            return limited_conversation + list(final_history) + conversation['input']
+        final_history.appendleft(message)
+    limited_conversation.extend(final_history)
+    limited_conversation.extend(conversation['input'])
+    return limited_conversation
+
+
+def make_conversation(size: int, seed: int = 0) -> dict:
+    rnd = random.Random(seed)
+    words = ['token', 'limit', 'context', 'history', 'model', 'assistant', 'prompt', 'reply']
+
+    def text():
+        return ' '.join(rnd.choice(words) for _ in range(rnd.randint(5, 120)))
+
+    return {
+        'context': [{'role': 'system', 'content': text()}],
+        'examples': [
+            {'role': 'user', 'name': 'example_user', 'content': text()},
+            {'role': 'assistant', 'name': 'example_assistant', 'content': text()},
+        ],
+        'chat_history': [
+            {'role': 'user' if idx % 2 == 0 else 'assistant', 'content': text()}
+            for idx in range(size)
+        ],
+        'input': [{'role': 'user', 'content': text()}],
+    }
+
+
+def measure(func, conversation: dict, cold: bool) -> float:
+    best = float('inf')
+    for _ in range(REPEATS):
+        if cold:
+            clear_token_cache()
+        start = time.perf_counter()
+        func(conversation, MODEL_NAME, MAX_RESPONSE_TOKENS, TOKEN_LIMIT)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f'{"messages":>8} {"cache":>5} {"legacy ms":>10} {"prefix ms":>10} {"speedup":>8}')
+    for size in SIZES:
+        conversation = make_conversation(size)
+        expected = legacy_limit_conversation(conversation, MODEL_NAME, MAX_RESPONSE_TOKENS, TOKEN_LIMIT)
+        actual = limit_conversation(conversation, MODEL_NAME, MAX_RESPONSE_TOKENS, TOKEN_LIMIT)
+        assert actual == expected, f'Output mismatch for {size} messages'
+        for cold in (True, False):
+            legacy = measure(legacy_limit_conversation, conversation, cold)
+            current = measure(limit_conversation, conversation, cold)
+            print(
+                f'{size:>8} {"cold" if cold else "warm":>5} '
+                f'{legacy * 1000:>10.2f} {current * 1000:>10.2f} {legacy / current:>7.1f}x'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import importlib
+import multiprocessing
+import os
+import sys
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, islice
+
+from pylon.core.tools import log
+
+from .utils import get_encoding
+
+
+CHUNK_SIZE = 4096
+INLINE_CHUNKS = 2
+# never fork: the plugin process runs the shared event loop and RPC threads, a forked child inherits their locks
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workers')
+WORKER_MODULE = 'open_ai_token_worker'
+
+
+def import_worker():
+    """
+    The worker module under a top-level name: unpickling a plugins.open_ai reference in a pool process
+    would import the plugin package, which needs the pylon runtime. Spawn and forkserver children
+    start with the parent's sys.path, so they find it in the same directory
+    """
+    if WORKER_PATH not in sys.path:
+        sys.path.append(WORKER_PATH)
+    return importlib.import_module(WORKER_MODULE)
+
+
+def _chunks(texts, size: int):
+    iterator = iter(texts)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class BulkTokenCounter:
+    """ Token counts of large text corpora in a process pool, started on first use """
+
+    def __init__(self, processes: int | None = None, chunk_size: int = CHUNK_SIZE):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self._executor = None
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def configure(self, processes: int | None = None, chunk_size: int | None = None):
+        self.shutdown()
+        if processes is not None:
+            self.processes = processes
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+    @property
+    def workers(self) -> int:
+        return self.processes or os.cpu_count() or 1
+
+    def _get_executor(self, encoding_name: str) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._worker = import_worker()
+                # workers preload the encoding of the first request, others load on first use
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context(START_METHOD),
+                    initializer=self._worker.load_encoding, initargs=(encoding_name,),
+                )
+                log.info('Started token counting pool with %s processes', self.workers)
+            return self._executor
+
+    def count(self, texts, model: str) -> array:
+        """ Token count of every text, in input order; texts may be any iterable, it is read lazily """
+        encoding = get_encoding(model)
+        counts = array('I')
+        chunks = _chunks(texts, self.chunk_size)
+        head = list(islice(chunks, INLINE_CHUNKS))
+        if len(head) < INLINE_CHUNKS or self.workers == 1:
+            # small inputs are not worth the IPC, tiktoken releases the GIL so batch threads still help
+            for chunk in chain(head, chunks):
+                counts.extend(map(len, encoding.encode_ordinary_batch(chunk)))
+            return counts
+        executor = self._get_executor(encoding.name)
+        count_chunk = self._worker.count_chunk
+        pending = deque()
+        for chunk in chain(head, chunks):
+            try:
+                future = executor.submit(count_chunk, encoding.name, chunk)
+            except RuntimeError:  # broken, or shut down by a concurrent configure()
+                future = None
+            pending.append((chunk, future))
+            # bounded read-ahead keeps memory flat for streamed input
+            if len(pending) >= 2 * self.workers:
+                self._collect(counts, encoding, executor, *pending.popleft())
+        while pending:
+            self._collect(counts, encoding, executor, *pending.popleft())
+        return counts
+
+    def _collect(self, counts: array, encoding, executor: ProcessPoolExecutor, chunk: list, future):
+        """ Pool result of a chunk, counted inline when the pool broke; the next count() starts a new one """
+        if future is not None:
+            try:
+                counts.frombytes(future.result())
+                return
+            except BrokenProcessPool as e:
+                self._discard(executor, e)
+        counts.extend(map(len, encoding.encode_ordinary_batch(chunk)))
+
+    def _discard(self, executor: ProcessPoolExecutor, error: BaseException):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        log.warning('Token counting pool broke, counting inline: %s', error)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+bulk_counter = BulkTokenCounter()
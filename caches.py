@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """ Thread-safe bounded LRU mapping with hit/miss counters """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class TTLCache(LRUCache):
+    """ LRUCache whose entries expire ttl seconds after being set """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 300):
+        super().__init__(maxsize=maxsize)
+        self.ttl = ttl
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        entry = super().get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            with self._lock:
+                if self._data.get(key) is entry:
+                    del self._data[key]
+                self.hits -= 1
+                self.misses += 1
+                self.expirations += 1
+            return default
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        super().set(key, (time.monotonic() + (self.ttl if ttl is None else ttl), value))
+
+    def pop(self, key, default=None):
+        entry = super().pop(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        return entry[1]
+
+    @property
+    def stats(self) -> dict:
+        return {**super().stats, 'ttl': self.ttl, 'expirations': self.expirations}
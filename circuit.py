@@ -0,0 +1,209 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from pylon.core.tools import log
+
+from .retry import is_retryable
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+OPTIONS = ('failure_rate', 'min_requests', 'window', 'open_duration', 'half_open_probes')
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, api_base: str, model: str, retry_after: float):
+        super().__init__(f'Circuit open for {model} at {api_base}, retry in {retry_after:.1f}s')
+        self.api_base = api_base
+        self.model = model
+        self.retry_after = retry_after
+
+
+def is_failure(error: BaseException) -> bool:
+    """ Outage-like errors trip the breaker, 429 is left to the rate limiter and 4xx mean upstream is up """
+    return is_retryable(error) and getattr(error, 'status_code', None) != 429
+
+
+class CircuitBreaker:
+    """ Failure rate over a sliding time window, used from the shared loop """
+
+    def __init__(
+            self, failure_rate: float = 0.5, min_requests: int = 10, window: float = 30.0,
+            open_duration: float = 30.0, half_open_probes: int = 1
+            ):
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_duration = open_duration
+        self.half_open_probes = half_open_probes
+        self._state = CLOSED
+        self._outcomes = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    @property
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.open_duration - time.monotonic())
+
+    def available(self) -> bool:
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and self._probes < self.half_open_probes)
+
+    def admits(self) -> bool:
+        """ Whether a call would be let through now, read-only so it is safe outside the shared loop """
+        if self._state == OPEN:
+            return time.monotonic() - self._opened_at >= self.open_duration
+        return self._state == CLOSED or self._probes < self.half_open_probes
+
+    def acquire(self) -> bool:
+        """ Take permission for one call, half-open lets a limited number of probes through """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probes < self.half_open_probes:
+            self._probes += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            _, failed = self._outcomes.popleft()
+            self._failures -= failed
+
+    def record(self, failed: bool, probe: bool = False) -> bool:
+        """ Count an outcome, True when it opened the circuit """
+        now = time.monotonic()
+        if probe:
+            self._probes -= 1
+            if failed:
+                self._open(now)
+            else:
+                self._close()
+            return failed
+        if self._state == HALF_OPEN:
+            return False  # calls started before the circuit opened say nothing about recovery
+        self._outcomes.append((now, failed))
+        self._failures += failed
+        self._prune(now)
+        if self._state == CLOSED and len(self._outcomes) >= self.min_requests \
+                and self._failures / len(self._outcomes) >= self.failure_rate:
+            self._open(now)
+            return True
+        return False
+
+    def release(self, probe: bool):
+        """ Give back the probe slot of a call that ended without an outcome (cancelled) """
+        if probe:
+            self._probes -= 1
+
+    def _open(self, now: float):
+        self._state = OPEN
+        self._opened_at = now
+        self.trips += 1
+
+    def _close(self):
+        self._state = CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+
+    def stats(self) -> dict:
+        self._prune(time.monotonic())
+        requests = len(self._outcomes)
+        return {
+            'state': self.state,
+            'requests': requests,
+            'failure_rate': self._failures / requests if requests else 0.0,
+            'retry_after': self.retry_after if self._state == OPEN else 0.0,
+            'trips': self.trips,
+            'rejected': self.rejected,
+        }
+
+
+class CircuitBreakers:
+    """ One breaker per (api_base, model) """
+
+    def __init__(self):
+        self.options = {}
+        self._breakers = {}
+
+    def configure(self, **kwargs):
+        unknown = set(kwargs) - set(OPTIONS)
+        if unknown:
+            raise ValueError(f'Unknown circuit breaker option: {", ".join(sorted(unknown))}')
+        self.options = kwargs
+        self._breakers = {}
+
+    def get(self, api_base: str, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get((api_base, model))
+        if breaker is None:
+            breaker = self._breakers[(api_base, model)] = CircuitBreaker(**self.options)
+        return breaker
+
+    def available(self, endpoints, model: str) -> list:
+        """ Endpoints whose breaker for this model lets calls through, raises when there are none """
+        available = [endpoint for endpoint in endpoints if self.get(endpoint.api_base, model).available()]
+        if not available:
+            breakers = [self.get(endpoint.api_base, model) for endpoint in endpoints]
+            for breaker in breakers:
+                breaker.rejected += 1
+            raise CircuitOpenError(endpoints[0].api_base, model, min(breaker.retry_after for breaker in breakers))
+        return available
+
+    def check(self, settings, model: str | None):
+        """
+        Fail fast before any request preparation when no endpoint can take calls for the model.
+        Runs in RPC threads, so it only reads breaker state: transitions and counters stay on the shared loop
+        """
+        if not model:
+            return
+        breakers = [self._breakers.get((endpoint.api_base, model)) for endpoint in settings.endpoint_list]
+        if any(breaker is None or breaker.admits() for breaker in breakers):
+            return
+        raise CircuitOpenError(
+            settings.endpoint_list[0].api_base, model, min(breaker.retry_after for breaker in breakers)
+        )
+
+    @contextmanager
+    def guard(self, api_base: str, model: str):
+        breaker = self.get(api_base, model)
+        if not breaker.acquire():
+            raise CircuitOpenError(api_base, model, breaker.retry_after)
+        probe = breaker.state == HALF_OPEN
+        try:
+            yield breaker
+        except Exception as e:
+            if breaker.record(is_failure(e), probe):
+                log.warning('Circuit opened for %s at %s', model, api_base)
+            raise
+        except BaseException:
+            breaker.release(probe)
+            raise
+        else:
+            breaker.record(False, probe)
+            if probe:
+                log.info('Circuit closed for %s at %s', model, api_base)
+
+    def reset(self):
+        self._breakers = {}
+
+    def stats(self) -> dict:
+        return {
+            f'{api_base} {model}': breaker.stats()
+            for (api_base, model), breaker in list(self._breakers.items())
+        }
+
+
+circuit_breakers = CircuitBreakers()
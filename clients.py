@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+from openai import AsyncAzureOpenAI, AsyncOpenAI
+from pylon.core.tools import log
+
+from .descriptors import unsecret
+from .endpoints import endpoint_pool
+
+
+def api_keys(endpoints, project_id) -> dict:
+    """
+    endpoint_pool.key -> api key of every endpoint. Unsecreting may reach the vault,
+    so it runs in the calling thread (TTL cached) before the request enters the shared loop
+    """
+    return {endpoint_pool.key(endpoint): unsecret(endpoint.api_token, project_id) for endpoint in endpoints}
+
+
+def create_async_client(settings, api_key: str, http_client: httpx.AsyncClient | None = None):
+    """ openai 1.x async client for integration settings, retries are left to retry.call_with_retry """
+    if settings.api_type == 'azure':
+        return AsyncAzureOpenAI(
+            api_key=api_key,
+            azure_endpoint=settings.api_base,
+            api_version=settings.api_version,
+            http_client=http_client,
+            max_retries=0,
+        )
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=settings.api_base,
+        http_client=http_client,
+        max_retries=0,
+    )
+
+
+class _PooledClient:
+    __slots__ = ('client', 'last_used', 'in_use')
+
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.in_use = 0
+
+
+class ClientRegistry:
+    """ One keep-alive client per (api_base, api_key, api_type, api_version), used from the shared loop """
+
+    def __init__(
+            self, max_connections: int = 100, max_keepalive_connections: int = 20,
+            keepalive_expiry: float = 30.0, idle_ttl: float = 600.0, sweep_interval: float = 60.0
+            ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._clients = {}
+        self._last_sweep = time.monotonic()
+        self._sweep = None
+        self._sweep_task = None
+
+    def configure(self, **kwargs):
+        for name, value in kwargs.items():
+            if not hasattr(self, name) or name.startswith('_'):
+                raise ValueError(f'Unknown client pool option: {name}')
+            setattr(self, name, value)
+
+    @staticmethod
+    def make_key(settings, api_key: str) -> tuple:
+        return (
+            settings.api_base,
+            hashlib.sha256(api_key.encode()).hexdigest(),
+            settings.api_type,
+            settings.api_version,
+        )
+
+    def _create(self, settings, api_key: str):
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+        )
+        return _PooledClient(create_async_client(settings, api_key, http_client=http_client))
+
+    @asynccontextmanager
+    async def client(self, settings, api_key: str):
+        """ Pooled client of an endpoint, api_key is already unsecreted (see api_keys) """
+        await self.evict_idle()
+        key = self.make_key(settings, api_key)
+        entry = self._clients.get(key)
+        if entry is None:
+            entry = self._clients[key] = self._create(settings, api_key)
+            log.info('Created OpenAI client for %s', settings.api_base)
+            self._schedule_sweep()
+        entry.in_use += 1
+        try:
+            yield entry.client
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+    def _schedule_sweep(self):
+        """ Periodic eviction while clients are pooled, an idle plugin makes no client() calls to trigger it """
+        loop = asyncio.get_running_loop()
+        if self._sweep is not None and self._sweep[0] is loop:
+            return
+        self._sweep = (loop, loop.call_later(self.sweep_interval, self._run_sweep))
+
+    def _run_sweep(self):
+        self._sweep = None
+        self._sweep_task = asyncio.ensure_future(self._sweep_idle())
+
+    async def _sweep_idle(self):
+        await self.evict_idle(force=True)
+        if self._clients:
+            self._schedule_sweep()
+
+    async def evict_idle(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        for key, entry in list(self._clients.items()):
+            if entry.in_use == 0 and now - entry.last_used > self.idle_ttl:
+                del self._clients[key]
+                await entry.client.close()
+
+    async def aclose(self):
+        if self._sweep is not None:
+            self._sweep[1].cancel()
+            self._sweep = None
+        clients, self._clients = self._clients, {}
+        for entry in clients.values():
+            await entry.client.close()
+
+    def stats(self) -> dict:
+        return {
+            'clients': len(self._clients),
+            'in_use': sum(entry.in_use for entry in list(self._clients.values())),
+        }
+
+
+client_registry = ClientRegistry()
@@ -0,0 +1,129 @@
+import json
+
+from tools import SecretString, worker_client  # pylint: disable=E0401
+
+from .caches import TTLCache
+from .endpoints import endpoint_pool
+from .models.integration_pd import VAULT_CACHE_TTL, IntegrationModel
+
+
+HELPER = "plugins.open_ai_worker.utils.ai.Helper"
+CHAT_MODEL_CLASS = "langchain_openai.chat_models.base.ChatOpenAI"
+LLM_CLASS = "langchain_openai.llms.base.OpenAI"
+MODEL_PARAMETERS = ("max_tokens", "temperature", "top_p")
+TEMPLATE_KEY_FIELDS = ("api_base", "api_token", "model_name")
+
+_templates = TTLCache(maxsize=256, ttl=VAULT_CACHE_TTL)
+_tokens = TTLCache(maxsize=1024, ttl=VAULT_CACHE_TTL)
+
+
+def _unsecret(value, project_id):
+    if isinstance(value, SecretString):
+        return value.unsecret(project_id)
+    return worker_client.unsecret_data(value, project_id)
+
+
+def unsecret(value, project_id):
+    """ Secret or raw settings value unsecreted, memoized for VAULT_CACHE_TTL """
+    key = (project_id, value)
+    try:
+        token = _tokens.get(key)
+    except TypeError:  # unhashable payload
+        return _unsecret(value, project_id)
+    if token is None:
+        token = _unsecret(value, project_id)
+        _tokens.set(key, token)
+    return token
+
+
+def json_copy(value):
+    """
+    Message lists are passed on as a shallow copy, the RPC transport serializes the descriptor anyway.
+    Anything else keeps the JSON round-trip normalization
+    """
+    if isinstance(value, list) and all(type(item) is dict for item in value):  # pylint: disable=C0123
+        return list(value)
+    return json.loads(json.dumps(value))
+
+
+class CallbackTemplate:
+    """ Parts of callback descriptors that only change with the integration settings """
+    __slots__ = ('integration', 'endpoints', 'api_base', 'api_token', 'model_info', 'model_kwargs')
+
+    def __init__(self, settings: dict):
+        self.integration = IntegrationModel.parse_cached(settings)
+        self.api_base = settings["api_base"]
+        self.api_token = settings["api_token"]
+        # the langchain targets only take base_url/api_key, so only endpoints speaking the primary's API qualify
+        self.endpoints = [
+            endpoint for endpoint in self.integration.endpoints
+            if (endpoint.api_type, endpoint.api_version) == (self.integration.api_type, self.integration.api_version)
+        ]
+        model_name = settings.get("model_name")
+        self.model_info = self.integration.get_model(model_name)
+        self.model_kwargs = {
+            "model": model_name,
+            **{param: settings[param] for param in MODEL_PARAMETERS if param in settings},
+        }
+
+    @property
+    def legacy_completion(self) -> bool:
+        return self.model_info is not None and not self.model_info.supports("chat_completion")
+
+    def endpoint(self, project_id) -> tuple:
+        """ (base_url, api_key) of the endpoint picked by the load balancer """
+        if not self.endpoints:
+            return self.api_base, unsecret(self.api_token, project_id)
+        endpoint = endpoint_pool.select(self.endpoints, self.integration.balancing)
+        return endpoint.api_base, unsecret(endpoint.api_token, project_id)
+
+    def descriptor(
+            self, project_id, target_class: str, method: str, method_kwargs: dict, streaming: bool = False
+            ) -> dict:
+        base_url, api_key = self.endpoint(project_id)
+        target_kwargs = {**self.model_kwargs, "base_url": base_url, "api_key": api_key}
+        if streaming:
+            target_kwargs["streaming"] = True
+        return {
+            "routing_key": None,
+            #
+            "target": HELPER,
+            "target_args": None,
+            "target_kwargs": {
+                "target_class": target_class,
+                "target_args": None,
+                "target_kwargs": target_kwargs,
+                "client_attr": None,
+            },
+            "target_io_bound": True,
+            #
+            "method": method,
+            "method_args": None,
+            "method_kwargs": method_kwargs,
+        }
+
+
+def get_template(settings: dict) -> CallbackTemplate:
+    """
+    Template of the settings, looked up by a few identifying fields and checked against a snapshot
+    of the settings it was built from: fingerprinting the whole payload per call costs more than the template saves
+    """
+    key = tuple(str(settings.get(name)) for name in TEMPLATE_KEY_FIELDS)
+    entry = _templates.get(key)
+    if entry is not None and entry[0] == settings:
+        return entry[1]
+    template = CallbackTemplate(settings)
+    _templates.set(key, (json.loads(json.dumps(settings, default=str)), template))
+    return template
+
+
+def clear():
+    _templates.clear()
+    _tokens.clear()
+
+
+def stats() -> dict:
+    return {
+        'templates': _templates.stats,
+        'tokens': _tokens.stats,
+    }
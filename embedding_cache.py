@@ -0,0 +1,135 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+from array import array
+
+from pylon.core.tools import log
+
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'open_ai', 'embeddings.sqlite3')
+QUERY_CHUNK = 500
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode()).digest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed float32 vector store keyed by (api_base, model_name, sha256(text)).
+    Only the in-process pipeline (open_ai__embed_* RPCs) reads it, the embed_* worker callbacks
+    and indexer_config hand the api key to worker-side OpenAIEmbeddings, which always calls the API
+    """
+
+    def __init__(self, path: str | None = DEFAULT_PATH, enabled: bool = True):
+        self.path = path
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def configure(self, path: str | None = None, enabled: bool | None = None):
+        with self._lock:
+            self._close()
+            if path is not None:
+                self.path = path
+            if enabled is not None:
+                self.enabled = enabled
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'api_base TEXT NOT NULL, model_name TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL, '
+                'PRIMARY KEY (api_base, model_name, text_hash)) WITHOUT ROWID'
+            )
+            self._connection = connection
+            log.info('Opened embedding cache at %s', self.path)
+        return self._connection
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def get_many(self, api_base: str, model_name: str, texts: list) -> list:
+        """ Cached vectors in input order, None for misses """
+        if not self.enabled:
+            return [None] * len(texts)
+        digests = [text_digest(text) for text in texts]
+        found = {}
+        with self._lock:
+            connection = self._connect()
+            unique = list(set(digests))
+            for offset in range(0, len(unique), QUERY_CHUNK):
+                chunk = unique[offset:offset + QUERY_CHUNK]
+                rows = connection.execute(
+                    'SELECT text_hash, vector FROM embeddings WHERE api_base = ? AND model_name = ? '
+                    f'AND text_hash IN ({",".join("?" * len(chunk))})',
+                    (api_base, model_name, *chunk),
+                )
+                found.update(rows)
+        vectors = []
+        for digest in digests:
+            blob = found.get(digest)
+            if blob is None:
+                vectors.append(None)
+                continue
+            vector = array('f')
+            vector.frombytes(blob)
+            vectors.append(vector.tolist())
+        hits = sum(vector is not None for vector in vectors)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, api_base: str, model_name: str, texts: list, vectors: list):
+        if not self.enabled or not texts:
+            return
+        rows = [
+            (api_base, model_name, text_digest(text), array('f', vector).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)', rows)
+
+    def clear(self, api_base: str | None = None, model_name: str | None = None):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                if api_base is None:
+                    connection.execute('DELETE FROM embeddings')
+                elif model_name is None:
+                    connection.execute('DELETE FROM embeddings WHERE api_base = ?', (api_base,))
+                else:
+                    connection.execute(
+                        'DELETE FROM embeddings WHERE api_base = ? AND model_name = ?', (api_base, model_name)
+                    )
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'path': self.path,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,117 @@
+import asyncio
+
+from . import runtime
+from .clients import client_registry
+from .descriptors import unsecret
+from .endpoints import endpoint_pool
+from .embedding_cache import embedding_cache
+from .models.integration_pd import IntegrationModel
+from .retry import call_with_retry
+from .utils import get_encoding
+
+
+def plan_batches(texts: list, model_name: str, max_items: int, max_tokens: int) -> list:
+    """ Split texts into contiguous (start, end) ranges bounded by item count and token size """
+    counts = [len(tokens) for tokens in get_encoding(model_name).encode_ordinary_batch(texts)]
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for idx, count in enumerate(counts):
+        if idx > start and (idx - start >= max_items or batch_tokens + count > max_tokens):
+            batches.append((start, idx))
+            start = idx
+            batch_tokens = 0
+        batch_tokens += count
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+async def _embed_batch(client, endpoint, model_name: str, texts: list, settings: IntegrationModel) -> list:
+    async def attempt():
+        with endpoint_pool.track(endpoint):
+            return await client.embeddings.create(model=model_name, input=texts)
+
+    response = await call_with_retry(
+        attempt, settings.embed_max_retries, settings.retry_deadline, label=f'embeddings {model_name}',
+    )
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+async def _embed_texts(
+        project_id: int, settings: IntegrationModel, endpoint, api_key: str, model_name: str, texts: list
+        ) -> list:
+    batches = await asyncio.get_running_loop().run_in_executor(
+        None, plan_batches, texts, model_name, settings.embed_batch_size, settings.embed_batch_tokens
+    )
+    vectors = [None] * len(texts)
+    fan_out = asyncio.Semaphore(settings.embed_concurrency)
+    in_flight = runtime.in_flight_limit((project_id, endpoint.api_base), settings.max_in_flight)
+
+    async def run_batch(client, start, end):
+        async with fan_out, in_flight:
+            vectors[start:end] = await _embed_batch(client, endpoint, model_name, texts[start:end], settings)
+
+    async with client_registry.client(endpoint, api_key) as client:
+        tasks = [asyncio.ensure_future(run_batch(client, start, end)) for start, end in batches]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+    return vectors
+
+
+async def embed_documents_async(
+        project_id: int, settings: IntegrationModel, endpoint, api_key: str, texts: list,
+        model_name: str | None = None
+        ) -> list:
+    """ Embed texts in concurrent batches, only cache misses reach the API, vectors keep input order """
+    model_name = model_name or settings.model_name
+    texts = list(texts)
+    if not texts:
+        return []
+    loop = asyncio.get_running_loop()
+    vectors = await loop.run_in_executor(
+        None, embedding_cache.get_many, settings.api_base, model_name, texts
+    )
+    missing = {}
+    for idx, vector in enumerate(vectors):
+        if vector is None:
+            missing.setdefault(texts[idx], []).append(idx)
+    if missing:
+        unique_texts = list(missing)
+        embedded = await _embed_texts(project_id, settings, endpoint, api_key, model_name, unique_texts)
+        await loop.run_in_executor(
+            None, embedding_cache.put_many, settings.api_base, model_name, unique_texts, embedded
+        )
+        for text, vector in zip(unique_texts, embedded):
+            for idx in missing[text]:
+                vectors[idx] = vector
+    return vectors
+
+
+async def embed_query_async(
+        project_id: int, settings: IntegrationModel, endpoint, api_key: str, text: str,
+        model_name: str | None = None
+        ) -> list:
+    vectors = await embed_documents_async(project_id, settings, endpoint, api_key, [text], model_name)
+    return vectors[0]
+
+
+def _resolve(project_id: int, settings: dict) -> tuple:
+    """ Settings, balanced endpoint and its api key, resolved before entering the loop (vault round-trips) """
+    settings = IntegrationModel.parse_cached(settings)
+    endpoint = endpoint_pool.select(settings.endpoint_list, settings.balancing)
+    return settings, endpoint, unsecret(endpoint.api_token, project_id)
+
+
+def embed_documents(project_id: int, settings: dict, texts: list, model_name: str | None = None) -> list:
+    settings, endpoint, api_key = _resolve(project_id, settings)
+    return runtime.run(embed_documents_async(project_id, settings, endpoint, api_key, texts, model_name))
+
+
+def embed_query(project_id: int, settings: dict, text: str, model_name: str | None = None) -> list:
+    settings, endpoint, api_key = _resolve(project_id, settings)
+    return runtime.run(embed_query_async(project_id, settings, endpoint, api_key, text, model_name))
@@ -0,0 +1,130 @@
+import hashlib
+import random
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from pylon.core.tools import log
+
+from .retry import is_retryable
+
+
+STRATEGIES = ('least_outstanding', 'latency_ewma')
+EWMA_ALPHA = 0.3
+EJECT_AFTER = 3
+EJECT_DURATION = 30.0
+EJECT_DURATION_MAX = 300.0
+
+
+@lru_cache(maxsize=1024)
+def token_fingerprint(api_token: str) -> str:
+    """ Endpoints sharing a base URL with different credentials are separate upstream accounts """
+    return hashlib.sha256(api_token.encode()).hexdigest()[:16]
+
+
+class EndpointState:
+    __slots__ = (
+        'outstanding', 'latency', 'consecutive_failures', 'ejected_until', 'eject_duration',
+        'requests', 'failures', 'ejections',
+    )
+
+    def __init__(self):
+        self.outstanding = 0
+        self.latency = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.eject_duration = EJECT_DURATION
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+
+class EndpointPool:
+    """ Health and load of upstream endpoints shared by all integrations pointing at them """
+
+    def __init__(self):
+        self._states = {}
+
+    @staticmethod
+    def key(endpoint) -> tuple:
+        return endpoint.api_base, endpoint.api_type, endpoint.api_version, token_fingerprint(str(endpoint.api_token))
+
+    def state(self, endpoint) -> EndpointState:
+        key = self.key(endpoint)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = EndpointState()
+        return state
+
+    def _score(self, endpoint, strategy: str) -> float:
+        state = self.state(endpoint)
+        load = (state.outstanding + 1) / max(endpoint.weight, 1e-6)
+        if strategy == 'latency_ewma':
+            # endpoints without a latency sample yet score best so they get probed
+            return load * (state.latency or 0.0)
+        return load
+
+    def select(self, endpoints: list, strategy: str = 'least_outstanding', exclude: tuple = ()):
+        """ Lowest scoring admitted endpoint, ejected ones are re-admitted once their ejection expires """
+        if len(endpoints) == 1:
+            return endpoints[0]
+        now = time.monotonic()
+        candidates = [
+            endpoint for endpoint in endpoints
+            if self.key(endpoint) not in exclude and self.state(endpoint).ejected_until <= now
+        ]
+        if not candidates:
+            # everything is ejected: fail open to the endpoint that comes back first
+            return min(endpoints, key=lambda endpoint: self.state(endpoint).ejected_until)
+        scores = [self._score(endpoint, strategy) for endpoint in candidates]
+        best = min(scores)
+        return random.choice([endpoint for endpoint, score in zip(candidates, scores) if score == best])
+
+    @contextmanager
+    def track(self, endpoint):
+        state = self.state(endpoint)
+        state.outstanding += 1
+        state.requests += 1
+        started = time.monotonic()
+        try:
+            yield state
+        except Exception as e:
+            if is_retryable(e):
+                self._failed(endpoint, state)
+            raise
+        else:
+            latency = time.monotonic() - started
+            state.latency = latency if state.latency is None else \
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * state.latency
+            state.consecutive_failures = 0
+            state.eject_duration = EJECT_DURATION
+        finally:
+            state.outstanding -= 1
+
+    def _failed(self, endpoint, state: EndpointState):
+        state.failures += 1
+        state.consecutive_failures += 1
+        if state.consecutive_failures >= EJECT_AFTER:
+            state.ejected_until = time.monotonic() + state.eject_duration
+            state.ejections += 1
+            log.warning('Ejecting endpoint %s for %.0fs', endpoint.api_base, state.eject_duration)
+            # a failed probe after re-admission keeps it out twice as long
+            state.eject_duration = min(state.eject_duration * 2, EJECT_DURATION_MAX)
+            state.consecutive_failures = EJECT_AFTER - 1
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            f'{api_base} ({api_version}) {fingerprint}' if api_version else f'{api_base} {fingerprint}': {
+                'outstanding': state.outstanding,
+                'latency_ewma': state.latency,
+                'requests': state.requests,
+                'failures': state.failures,
+                'ejections': state.ejections,
+                'ejected': state.ejected_until > now,
+            }
+            for (api_base, _, api_version, fingerprint), state in list(self._states.items())
+        }
+
+
+endpoint_pool = EndpointPool()
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from collections import deque
+
+
+MIN_SAMPLES = 20
+BUDGET_BURST = 10.0
+
+
+class Hedger:
+    """ Recent latencies and hedge budget of one model, used from the shared loop """
+
+    def __init__(self, history: int = 512):
+        self._latencies = deque(maxlen=history)
+        self._tokens = 0.0
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+
+    def record(self, latency: float):
+        self._latencies.append(latency)
+
+    def delay(self, percentile: float) -> float | None:
+        """ Latency percentile to wait before hedging, None until enough samples are seen """
+        if len(self._latencies) < MIN_SAMPLES:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def credit(self, budget: float):
+        """ Every request earns `budget` of a hedge, so hedges stay below that share of traffic """
+        self.requests += 1
+        self._tokens = min(BUDGET_BURST, self._tokens + budget)
+
+    def take(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        self.hedged += 1
+        return True
+
+    def stats(self, percentile: float = 95.0) -> dict:
+        return {
+            'requests': self.requests,
+            'hedged': self.hedged,
+            'hedge_wins': self.wins,
+            'samples': len(self._latencies),
+            f'p{percentile:g}': self.delay(percentile),
+        }
+
+
+_hedgers = {}
+
+
+def get_hedger(model: str) -> Hedger:
+    hedger = _hedgers.get(model)
+    if hedger is None:
+        hedger = _hedgers[model] = Hedger()
+    return hedger
+
+
+async def hedged(call, hedger: Hedger, percentile: float, budget: float):
+    """
+    Await call(), firing a second call() if the first one is slower than the latency percentile
+    and the budget allows, first successful result wins and the other call is cancelled
+    """
+    hedger.credit(budget)
+    started = time.monotonic()
+    tasks = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedger.delay(percentile))
+        if not done and hedger.take():
+            tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            errors = {task: task.exception() for task in done}
+            for task, task_error in errors.items():
+                if task_error is None:
+                    hedger.record(time.monotonic() - started)
+                    if task is not tasks[0]:
+                        hedger.wins += 1
+                    return task.result()
+                error = error or task_error
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def stats() -> dict:
+    return {model: hedger.stats() for model, hedger in list(_hedgers.items())}
@@ -22,7 +22,9 @@ import json
 from pylon.core.tools import log  # pylint: disable=E0611,E0401,W0611
 from pylon.core.tools import web  # pylint: disable=E0611,E0401,W0611
 
-from tools import worker_client  # pylint: disable=E0401
+from .. import metrics
+from ..descriptors import CHAT_MODEL_CLASS, HELPER, LLM_CLASS, get_template, json_copy
+from ..models.integration_pd import IntegrationModel
 
 
 class Method:  # pylint: disable=E1101,R0903,W0201
@@ -40,23 +42,25 @@ class Method:  # pylint: disable=E1101,R0903,W0201
     #
 
     @web.method()
+    @metrics.timed_callback
     def ai_check_settings(  # pylint: disable=R0913
             self, settings,
         ):
         """ Check integration settings/test connection """
-        settings = json.loads(json.dumps(settings))
+        # plain JSON values of the two fields used, not a copy of the whole settings payload
+        base_url, api_key = json.loads(json.dumps([settings["api_base"], settings["api_token"]]))
         #
         result = {
             "routing_key": None,
             #
-            "target": "plugins.open_ai_worker.utils.ai.Helper",
+            "target": HELPER,
             "target_args": None,
             "target_kwargs": {
-                "target_class": "langchain_openai.chat_models.base.ChatOpenAI",
+                "target_class": CHAT_MODEL_CLASS,
                 "target_args": None,
                 "target_kwargs": {
-                    "base_url": settings["api_base"],
-                    "api_key": settings["api_token"],
+                    "base_url": base_url,
+                    "api_key": api_key,
                 },
                 "client_attr": "client._client",
             },
@@ -70,23 +74,25 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         return result
 
     @web.method()
+    @metrics.timed_callback
     def ai_get_models(  # pylint: disable=R0913
             self, settings,
         ):
         """ Get model list """
-        settings = json.loads(json.dumps(settings))
+        # plain JSON values of the two fields used, not a copy of the whole settings payload
+        base_url, api_key = json.loads(json.dumps([settings["api_base"], settings["api_token"]]))
         #
         result = {
             "routing_key": None,
             #
-            "target": "plugins.open_ai_worker.utils.ai.Helper",
+            "target": HELPER,
             "target_args": None,
             "target_kwargs": {
-                "target_class": "langchain_openai.chat_models.base.ChatOpenAI",
+                "target_class": CHAT_MODEL_CLASS,
                 "target_args": None,
                 "target_kwargs": {
-                    "base_url": settings["api_base"],
-                    "api_key": settings["api_token"],
+                    "base_url": base_url,
+                    "api_key": api_key,
                 },
                 "client_attr": "client._client",
             },
@@ -100,6 +106,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         return result
 
     @web.method()
+    @metrics.timed_callback
     def count_tokens(  # pylint: disable=R0913
             self, settings, data,
         ):
@@ -110,63 +117,20 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         except AttributeError:
             project_id = None
         #
-        api_token = worker_client.unsecret_data(
-            settings.merged_settings["api_token"], project_id
-        )
-        #
-        model_parameters = {}
-        #
-        for param in ["max_tokens", "temperature", "top_p"]:
-            if param in settings.merged_settings:
-                model_parameters[param] = settings.merged_settings[param]
-        #
         if isinstance(data, list):
-            data = json.loads(json.dumps(data))
+            data = json_copy(data)
         #
-        model_is_legacy_completion = False
-        for model_data in settings.merged_settings["models"]:
-            if model_data["name"] == settings.merged_settings["model_name"]:
-                if not model_data["capabilities"]["chat_completion"]:
-                    model_is_legacy_completion = True
+        template = get_template(settings.merged_settings)
+        target_class = LLM_CLASS if template.legacy_completion else CHAT_MODEL_CLASS
         #
-        target_class = "langchain_openai.chat_models.base.ChatOpenAI"
-        if model_is_legacy_completion:
-            target_class = "langchain_openai.llms.base.OpenAI"
-        #
-        result = {
-            "routing_key": None,
-            #
-            "target": "plugins.open_ai_worker.utils.ai.Helper",
-            "target_args": None,
-            "target_kwargs": {
-                "target_class": target_class,
-                "target_args": None,
-                "target_kwargs": {
-                    "model": settings.merged_settings["model_name"],
-                    #
-                    **model_parameters,
-                    #
-                    "base_url": settings.merged_settings["api_base"],
-                    "api_key": api_token,
-                },
-                "client_attr": None,
-            },
-            "target_io_bound": True,
-            #
-            "method": "count_tokens",
-            "method_args": None,
-            "method_kwargs": {
-                "data": data,
-            },
-        }
-        #
-        return result
+        return template.descriptor(project_id, target_class, "count_tokens", {"data": data})
 
     #
     # LLM
     #
 
     @web.method()
+    @metrics.timed_callback
     def llm_invoke(  # pylint: disable=R0913
             self, settings, text,
         ):
@@ -177,46 +141,12 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         except AttributeError:
             project_id = None
         #
-        api_token = worker_client.unsecret_data(
-            settings.merged_settings["api_token"], project_id
+        return get_template(settings.merged_settings).descriptor(
+            project_id, LLM_CLASS, "llm_invoke", {"text": text},
         )
-        #
-        model_parameters = {}
-        #
-        for param in ["max_tokens", "temperature", "top_p"]:
-            if param in settings.merged_settings:
-                model_parameters[param] = settings.merged_settings[param]
-        #
-        result = {
-            "routing_key": None,
-            #
-            "target": "plugins.open_ai_worker.utils.ai.Helper",
-            "target_args": None,
-            "target_kwargs": {
-                "target_class": "langchain_openai.llms.base.OpenAI",
-                "target_args": None,
-                "target_kwargs": {
-                    "model": settings.merged_settings["model_name"],
-                    #
-                    **model_parameters,
-                    #
-                    "base_url": settings.merged_settings["api_base"],
-                    "api_key": api_token,
-                },
-                "client_attr": None,
-            },
-            "target_io_bound": True,
-            #
-            "method": "llm_invoke",
-            "method_args": None,
-            "method_kwargs": {
-                "text": text,
-            },
-        }
-        #
-        return result
 
     @web.method()
+    @metrics.timed_callback
     def llm_stream(  # pylint: disable=R0913
             self, settings, text, stream_id,
         ):
@@ -227,53 +157,16 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         except AttributeError:
             project_id = None
         #
-        api_token = worker_client.unsecret_data(
-            settings.merged_settings["api_token"], project_id
+        return get_template(settings.merged_settings).descriptor(
+            project_id, LLM_CLASS, "llm_stream", {"text": text, "stream_id": stream_id}, streaming=True,
         )
-        #
-        model_parameters = {}
-        #
-        for param in ["max_tokens", "temperature", "top_p"]:
-            if param in settings.merged_settings:
-                model_parameters[param] = settings.merged_settings[param]
-        #
-        result = {
-            "routing_key": None,
-            #
-            "target": "plugins.open_ai_worker.utils.ai.Helper",
-            "target_args": None,
-            "target_kwargs": {
-                "target_class": "langchain_openai.llms.base.OpenAI",
-                "target_args": None,
-                "target_kwargs": {
-                    "model": settings.merged_settings["model_name"],
-                    #
-                    **model_parameters,
-                    #
-                    "base_url": settings.merged_settings["api_base"],
-                    "api_key": api_token,
-                    #
-                    "streaming": True,
-                },
-                "client_attr": None,
-            },
-            "target_io_bound": True,
-            #
-            "method": "llm_stream",
-            "method_args": None,
-            "method_kwargs": {
-                "text": text,
-                "stream_id": stream_id,
-            },
-        }
-        #
-        return result
 
     #
     # ChatModel
     #
 
     @web.method()
+    @metrics.timed_callback
     def chat_model_invoke(  # pylint: disable=R0913
             self, settings, messages,
         ):
@@ -284,46 +177,12 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         except AttributeError:
             project_id = None
         #
-        api_token = worker_client.unsecret_data(
-            settings.merged_settings["api_token"], project_id
+        return get_template(settings.merged_settings).descriptor(
+            project_id, CHAT_MODEL_CLASS, "chat_invoke", {"messages": json_copy(messages)},
         )
-        #
-        model_parameters = {}
-        #
-        for param in ["max_tokens", "temperature", "top_p"]:
-            if param in settings.merged_settings:
-                model_parameters[param] = settings.merged_settings[param]
-        #
-        result = {
-            "routing_key": None,
-            #
-            "target": "plugins.open_ai_worker.utils.ai.Helper",
-            "target_args": None,
-            "target_kwargs": {
-                "target_class": "langchain_openai.chat_models.base.ChatOpenAI",
-                "target_args": None,
-                "target_kwargs": {
-                    "model": settings.merged_settings["model_name"],
-                    #
-                    **model_parameters,
-                    #
-                    "base_url": settings.merged_settings["api_base"],
-                    "api_key": api_token,
-                },
-                "client_attr": None,
-            },
-            "target_io_bound": True,
-            #
-            "method": "chat_invoke",
-            "method_args": None,
-            "method_kwargs": {
-                "messages": json.loads(json.dumps(messages)),
-            },
-        }
-        #
-        return result
 
     @web.method()
+    @metrics.timed_callback
     def chat_model_stream(  # pylint: disable=R0913
             self, settings, messages, stream_id,
         ):
@@ -334,59 +193,28 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         except AttributeError:
             project_id = None
         #
-        api_token = worker_client.unsecret_data(
-            settings.merged_settings["api_token"], project_id
+        return get_template(settings.merged_settings).descriptor(
+            project_id, CHAT_MODEL_CLASS, "chat_stream",
+            {"messages": json_copy(messages), "stream_id": stream_id}, streaming=True,
         )
-        #
-        model_parameters = {}
-        #
-        for param in ["max_tokens", "temperature", "top_p"]:
-            if param in settings.merged_settings:
-                model_parameters[param] = settings.merged_settings[param]
-        #
-        result = {
-            "routing_key": None,
-            #
-            "target": "plugins.open_ai_worker.utils.ai.Helper",
-            "target_args": None,
-            "target_kwargs": {
-                "target_class": "langchain_openai.chat_models.base.ChatOpenAI",
-                "target_args": None,
-                "target_kwargs": {
-                    "model": settings.merged_settings["model_name"],
-                    #
-                    **model_parameters,
-                    #
-                    "base_url": settings.merged_settings["api_base"],
-                    "api_key": api_token,
-                    #
-                    "streaming": True,
-                },
-                "client_attr": None,
-            },
-            "target_io_bound": True,
-            #
-            "method": "chat_stream",
-            "method_args": None,
-            "method_kwargs": {
-                "messages": json.loads(json.dumps(messages)),
-                "stream_id": stream_id,
-            },
-        }
-        #
-        return result
 
     #
     # Embed
     #
 
     @web.method()
+    @metrics.timed_callback
     def embed_documents(  # pylint: disable=R0913
             self, settings, texts,
         ):
-        """ Make embeddings """
-        api_token = settings["integration_data"]["settings"]["api_token"]
+        """ Make embeddings, run by the worker: open_ai__embed_documents is the cached, batched path """
+        base_url, api_token = get_template(settings["integration_data"]["settings"]).endpoint(
+            settings["integration_data"].get("project_id")
+        )
         model_name = settings["model_name"]
+        batch_size = IntegrationModel.parse_cached(
+            settings["integration_data"]["settings"]
+        ).embed_batch_size
         #
         result = {
             "routing_key": None,
@@ -399,8 +227,10 @@ class Method:  # pylint: disable=E1101,R0903,W0201
                 "target_kwargs": {
                     "model": model_name,
                     #
-                    "base_url": settings["integration_data"]["settings"]["api_base"],
+                    "base_url": base_url,
                     "api_key": api_token,
+                    #
+                    "chunk_size": batch_size,
                 },
                 "client_attr": None,
             },
@@ -416,11 +246,14 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         return result
 
     @web.method()
+    @metrics.timed_callback
     def embed_query(  # pylint: disable=R0913
             self, settings, text,
         ):
-        """ Make embedding """
-        api_token = settings["integration_data"]["settings"]["api_token"]
+        """ Make embedding, run by the worker: open_ai__embed_query is the cached path """
+        base_url, api_token = get_template(settings["integration_data"]["settings"]).endpoint(
+            settings["integration_data"].get("project_id")
+        )
         model_name = settings["model_name"]
         #
         result = {
@@ -434,7 +267,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
                 "target_kwargs": {
                     "model": model_name,
                     #
-                    "base_url": settings["integration_data"]["settings"]["api_base"],
+                    "base_url": base_url,
                     "api_key": api_token,
                 },
                 "client_attr": None,
@@ -455,17 +288,13 @@ class Method:  # pylint: disable=E1101,R0903,W0201
     #
 
     @web.method()
+    @metrics.timed_callback
     def indexer_config(  # pylint: disable=R0913
             self, settings, model,
         ):
         """ Make indexer config """
         #
-        model_info = None
-        #
-        for item in settings["settings"]["models"]:
-            if item["name"] == model:
-                model_info = item
-                break
+        model_info = IntegrationModel.parse_cached(settings["settings"]).get_model(model)
         #
         if model_info is None:
             raise RuntimeError(f"No model info found: {model}")
@@ -475,17 +304,15 @@ class Method:  # pylint: disable=E1101,R0903,W0201
         except (AttributeError, KeyError):
             project_id = None
         #
-        api_token = worker_client.unsecret_data(
-            settings["settings"]["api_token"], project_id
-        )
+        base_url, api_token = get_template(settings["settings"]).endpoint(project_id)
         #
-        if model_info["capabilities"]["embeddings"]:
+        if model_info.supports("embeddings"):
             return {
                 "embedding_model": "langchain_openai.embeddings.base.OpenAIEmbeddings",
                 "embedding_model_params": {
                     "model": model,
                     #
-                    "base_url": settings["settings"]["api_base"],
+                    "base_url": base_url,
                     "api_key": api_token,
                 },
             }
@@ -496,7 +323,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
             if param in settings["settings"]:
                 model_parameters[param] = settings["settings"][param]
         #
-        if not model_info["capabilities"]["chat_completion"]:
+        if not model_info.supports("chat_completion"):
             return {
                 "ai_model": "langchain_openai.llms.base.OpenAI",
                 "ai_model_params": {
@@ -504,7 +331,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
                     #
                     **model_parameters,
                     #
-                    "base_url": settings["settings"]["api_base"],
+                    "base_url": base_url,
                     "api_key": api_token,
                 },
             }
@@ -516,7 +343,7 @@ class Method:  # pylint: disable=E1101,R0903,W0201
                 #
                 **model_parameters,
                 #
-                "base_url": settings["settings"]["api_base"],
+                "base_url": base_url,
                 "api_key": api_token,
             },
         }
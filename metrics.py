@@ -0,0 +1,168 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """ Labelled metric, safe to update from RPC threads and the shared loop """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: tuple, value) -> list:
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (not cumulative) counts, the last slot is +Inf, then sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self, key: tuple, value) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(float(bound))}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(value[-1])}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+RPC_SECONDS = Histogram('open_ai_rpc_seconds', 'Time spent in open_ai RPC handlers', ('rpc',))
+RPC_CALLS = Counter('open_ai_rpc_calls_total', 'open_ai RPC calls by outcome', ('rpc', 'outcome'))
+CALLBACK_SECONDS = Histogram(
+    'open_ai_callback_seconds', 'Time spent building worker_client callbacks', ('method',), FAST_BUCKETS
+)
+CALLBACK_CALLS = Counter('open_ai_callback_calls_total', 'worker_client callbacks by outcome', ('method', 'outcome'))
+TOKEN_COUNT_SECONDS = Histogram(
+    'open_ai_token_count_seconds', 'Time spent counting message tokens', ('model',), FAST_BUCKETS
+)
+TRIM_SECONDS = Histogram(
+    'open_ai_trim_seconds', 'Time spent trimming conversations to the token limit', ('model',), FAST_BUCKETS
+)
+UPSTREAM_SECONDS = Histogram(
+    'open_ai_upstream_seconds', 'Upstream request latency per attempt', ('model', 'kind', 'outcome')
+)
+PROMPT_TOKENS = Counter('open_ai_prompt_tokens_total', 'Prompt tokens reported by upstream', ('model', 'project_id'))
+COMPLETION_TOKENS = Counter(
+    'open_ai_completion_tokens_total', 'Completion tokens reported by upstream', ('model', 'project_id')
+)
+
+
+def record_usage(project_id, model: str, usage: dict | None):
+    if usage:
+        PROMPT_TOKENS.inc(usage.get('prompt_tokens') or 0, model=model, project_id=project_id)
+        COMPLETION_TOKENS.inc(usage.get('completion_tokens') or 0, model=model, project_id=project_id)
+
+
+def _timed(histogram: Histogram, counter: Counter, label: str):
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func(*args, **kwargs)
+                # RPCs report handled failures as {"ok": False, ...}
+                if not (isinstance(result, dict) and result.get('ok') is False):
+                    outcome = 'ok'
+                return result
+            finally:
+                histogram.observe(time.perf_counter() - started, **{label: name})
+                counter.inc(**{label: name, 'outcome': outcome})
+
+        return wrapper
+
+    return decorator
+
+
+timed_rpc = _timed(RPC_SECONDS, RPC_CALLS, 'rpc')
+timed_callback = _timed(CALLBACK_SECONDS, CALLBACK_CALLS, 'method')
+
+
+def render() -> str:
+    """ All metrics in the Prometheus text exposition format """
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
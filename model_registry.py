@@ -0,0 +1,131 @@
+from typing import Optional
+
+
+DEFAULT_TOKEN_LIMIT = 8096
+
+# seeded by earlier releases: vault entries still holding these values are upgraded on init,
+# model token limits stored with them count as unset
+LEGACY_TOKEN_LIMITS = {
+    'gpt-3.5-turbo-instruct': 4097,
+    'babbage-002': 16384,
+    'davinci-002': 16384,
+    'gpt-4': 8192,
+    'gpt-4-0613': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-32k-0613': 32768,
+    'gpt-3.5-turbo': 4097,
+    'gpt-3.5-turbo-0613': 4097,
+    'gpt-3.5-turbo-16k': 16385,
+    'gpt-3.5-turbo-16k-0613': 16385,
+    'text-embedding-ada-002': None,
+    'text-davinci-003': 4097,
+    'text-davinci-002': 4097,
+    'code-davinci-002': 8001
+}
+
+
+class ModelSpec:
+    """ Context window (prompt and completion together), completion cap and tokenizer of a model family """
+    __slots__ = ('context_window', 'max_output', 'encoding', 'tokens_per_message', 'tokens_per_name')
+
+    def __init__(
+            self, context_window: int, max_output: Optional[int], encoding: str,
+            tokens_per_message: int = 3, tokens_per_name: int = 1
+            ):
+        self.context_window = context_window
+        self.max_output = max_output
+        self.encoding = encoding
+        self.tokens_per_message = tokens_per_message
+        self.tokens_per_name = tokens_per_name
+
+
+# dated snapshots and fine-tunes resolve to the longest matching entry,
+# so only snapshots that differ from their family are listed
+MODELS = {
+    'gpt-5': ModelSpec(400000, 128000, 'o200k_base'),
+    'gpt-5-mini': ModelSpec(400000, 128000, 'o200k_base'),
+    'gpt-5-nano': ModelSpec(400000, 128000, 'o200k_base'),
+    'gpt-4.1': ModelSpec(1047576, 32768, 'o200k_base'),
+    'gpt-4.1-mini': ModelSpec(1047576, 32768, 'o200k_base'),
+    'gpt-4.1-nano': ModelSpec(1047576, 32768, 'o200k_base'),
+    'gpt-4o': ModelSpec(128000, 16384, 'o200k_base'),
+    'gpt-4o-2024-05-13': ModelSpec(128000, 4096, 'o200k_base'),
+    'gpt-4o-mini': ModelSpec(128000, 16384, 'o200k_base'),
+    'o1': ModelSpec(200000, 100000, 'o200k_base'),
+    'o1-preview': ModelSpec(128000, 32768, 'o200k_base'),
+    'o1-mini': ModelSpec(128000, 65536, 'o200k_base'),
+    'o3': ModelSpec(200000, 100000, 'o200k_base'),
+    'o3-mini': ModelSpec(200000, 100000, 'o200k_base'),
+    'o4-mini': ModelSpec(200000, 100000, 'o200k_base'),
+    'gpt-4-turbo': ModelSpec(128000, 4096, 'cl100k_base'),
+    'gpt-4-turbo-preview': ModelSpec(128000, 4096, 'cl100k_base'),
+    'gpt-4-1106-preview': ModelSpec(128000, 4096, 'cl100k_base'),
+    'gpt-4-0125-preview': ModelSpec(128000, 4096, 'cl100k_base'),
+    'gpt-4-vision-preview': ModelSpec(128000, 4096, 'cl100k_base'),
+    'gpt-4': ModelSpec(8192, 8192, 'cl100k_base'),
+    'gpt-4-32k': ModelSpec(32768, 32768, 'cl100k_base'),
+    'gpt-3.5-turbo': ModelSpec(16385, 4096, 'cl100k_base'),
+    # every message follows <|start|>{role/name}\n{content}<|end|>\n, if there's a name the role is omitted
+    'gpt-3.5-turbo-0301': ModelSpec(4096, 4096, 'cl100k_base', tokens_per_message=4, tokens_per_name=-1),
+    'gpt-3.5-turbo-0613': ModelSpec(4096, 4096, 'cl100k_base'),
+    'gpt-3.5-turbo-16k': ModelSpec(16385, 4096, 'cl100k_base'),
+    'gpt-3.5-turbo-instruct': ModelSpec(4096, 4096, 'cl100k_base'),
+    # completion models keep the message format their counts always used
+    'babbage-002': ModelSpec(16384, 16384, 'cl100k_base', tokens_per_message=4, tokens_per_name=-1),
+    'davinci-002': ModelSpec(16384, 16384, 'cl100k_base', tokens_per_message=4, tokens_per_name=-1),
+    'text-davinci-003': ModelSpec(4097, 4097, 'p50k_base', tokens_per_message=4, tokens_per_name=-1),
+    'text-davinci-002': ModelSpec(4097, 4097, 'p50k_base', tokens_per_message=4, tokens_per_name=-1),
+    'code-davinci-002': ModelSpec(8001, 8001, 'p50k_base', tokens_per_message=4, tokens_per_name=-1),
+    'text-embedding-3-large': ModelSpec(8191, None, 'cl100k_base'),
+    'text-embedding-3-small': ModelSpec(8191, None, 'cl100k_base'),
+    'text-embedding-ada-002': ModelSpec(8191, None, 'cl100k_base'),
+}
+
+_resolved = {}
+
+
+def base_model(model: str) -> str:
+    """ Base model of a fine-tune id: ft:gpt-4o-mini-2024-07-18:org::id and legacy curie:ft-org-... """
+    if model.startswith('ft:'):
+        model = model[3:]
+    return model.split(':', 1)[0]
+
+
+def resolve(model: str) -> Optional[str]:
+    """ Registry entry of a model id: exact match, else the longest entry followed by a '-' suffix """
+    if model in _resolved:
+        return _resolved[model]
+    name = base_model(model)
+    entry = name if name in MODELS else None
+    if entry is None:
+        prefixes = [key for key in MODELS if name.startswith(f'{key}-')]
+        entry = max(prefixes, key=len) if prefixes else None
+    _resolved[model] = entry
+    return entry
+
+
+def get_spec(model: str) -> Optional[ModelSpec]:
+    entry = resolve(model)
+    return MODELS[entry] if entry is not None else None
+
+
+def context_window(model: str, default: Optional[int] = DEFAULT_TOKEN_LIMIT) -> Optional[int]:
+    spec = get_spec(model)
+    return spec.context_window if spec is not None else default
+
+
+def response_reserve(model: str, max_tokens: int) -> int:
+    """ Tokens kept free for the completion, the model never produces more than its output cap """
+    spec = get_spec(model)
+    if spec is None or spec.max_output is None:
+        return max_tokens
+    return min(max_tokens, spec.max_output)
+
+
+def is_legacy_token_limit(model: str, value: Optional[int]) -> bool:
+    """ A stored limit that is only a default seeded by earlier releases, not a user's choice """
+    return value == DEFAULT_TOKEN_LIMIT or (value is not None and value == LEGACY_TOKEN_LIMITS.get(model))
+
+
+def token_limits() -> dict:
+    return {name: spec.context_window for name, spec in MODELS.items()}
@@ -1,21 +1,74 @@
+import hashlib
 import json
-from typing import List, Optional
-from pydantic.v1 import BaseModel, root_validator, validator
+import threading
+from types import MappingProxyType
+from typing import List, Literal, Mapping, Optional
+from pydantic.v1 import BaseModel, PrivateAttr, root_validator, validator
 
 from tools import session_project, rpc_tools, VaultClient, worker_client, this, SecretString
 from pylon.core.tools import log
 
+from ..caches import TTLCache
+from ..model_registry import context_window, is_legacy_token_limit
+
+
+CAPABILITIES_MAP_SECRET = 'open_ai_capatibilities_map'
+TOKEN_LIMITS_SECRET = 'open_ai_token_limits'
+VAULT_CACHE_TTL = 300
+
+SETTINGS_CACHE_SIZE = 256
+
+_vault_cache = TTLCache(maxsize=16, ttl=VAULT_CACHE_TTL)
+# parsed models embed vault derived defaults, so they expire together with them
+_settings_cache = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=VAULT_CACHE_TTL)
+_vault_lock = threading.Lock()
+
+
+def cache_vault_settings(secrets: dict):
+    """ Write capabilities map and token limits from already loaded secrets into the cache """
+    for name in (CAPABILITIES_MAP_SECRET, TOKEN_LIMITS_SECRET):
+        if name in secrets:
+            _vault_cache.set(name, json.loads(secrets[name]))
+
+
+def invalidate_vault_cache():
+    _vault_cache.clear()
+    _settings_cache.clear()
+
+
+def vault_cache_stats() -> dict:
+    return _vault_cache.stats
+
+
+def settings_fingerprint(settings: dict) -> str:
+    """ Stable digest of a settings payload, secret values only ever enter the hash input """
+    payload = json.dumps(settings, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def settings_cache_stats() -> dict:
+    return _settings_cache.stats
+
+
+def _get_vault_setting(name: str):
+    value = _vault_cache.get(name)
+    if value is None:
+        with _vault_lock:
+            value = _vault_cache.get(name)
+            if value is None:
+                vault_client = VaultClient()
+                secrets = vault_client.get_all_secrets()
+                cache_vault_settings(secrets)
+                value = json.loads(secrets.get(name, ''))
+    return value
+
 
 def get_capabilities_map():
-    vault_client = VaultClient()
-    secrets = vault_client.get_all_secrets()
-    return json.loads(secrets.get('open_ai_capatibilities_map', ''))
+    return _get_vault_setting(CAPABILITIES_MAP_SECRET)
 
 
 def get_token_limits():
-    vault_client = VaultClient()
-    secrets = vault_client.get_all_secrets()
-    return json.loads(secrets.get('open_ai_token_limits', ''))
+    return _get_vault_setting(TOKEN_LIMITS_SECRET)
 
 
 class CapabilitiesModel(BaseModel):
@@ -46,10 +99,24 @@ class AIModel(BaseModel):
 
     @validator('token_limit', always=True, check_fields=False)
     def token_limit_validator(cls, value, values):
-        if value:
+        if value and not is_legacy_token_limit(values.get('id', ''), value):
             return value
         token_limits = get_token_limits()
-        return token_limits.get(values.get('id'), 8096)
+        return token_limits.get(values.get('id')) or context_window(values.get('id', ''))
+
+    def supports(self, capability: str) -> bool:
+        capabilities = self.capabilities
+        if isinstance(capabilities, BaseModel):
+            return bool(getattr(capabilities, capability, False))
+        return bool(capabilities.get(capability))
+
+class EndpointModel(BaseModel):
+    api_base: str
+    api_token: SecretString | str
+    api_type: str = "open_ai"
+    api_version: str | None = None
+    weight: float = 1.0
+
 
 class IntegrationModel(BaseModel):
     api_token: SecretString | str
@@ -61,6 +128,27 @@ class IntegrationModel(BaseModel):
     temperature: float = 1.0
     max_tokens: int = 512
     top_p: float = 0.8
+    endpoints: List[EndpointModel] = []
+    balancing: Literal['least_outstanding', 'latency_ewma'] = 'least_outstanding'
+    max_in_flight: int = 64
+    embed_batch_size: int = 512
+    embed_batch_tokens: int = 100000
+    embed_concurrency: int = 4
+    embed_max_retries: int = 3
+    response_cache: bool = False
+    response_cache_ttl: int = 3600
+    coalesce_requests: bool = True
+    rpm_limit: Optional[int] = None
+    max_retries: int = 3
+    retry_deadline: float = 60.0
+    tpm_limit: Optional[int] = None
+    hedge_requests: bool = False
+    hedge_percentile: float = 95.0
+    hedge_budget: float = 0.05
+    hedge_other_endpoint: bool = True
+
+    _model_index: Optional[Mapping[str, AIModel]] = PrivateAttr(default=None)
+    _endpoint_list: Optional[tuple] = PrivateAttr(default=None)
 
     @root_validator(pre=True)
     def prepare_model_list(cls, values):
@@ -69,12 +157,64 @@ class IntegrationModel(BaseModel):
             values['models'] = [AIModel(id=model, name=model).dict(by_alias=True) for model in models]
         return values
 
+    @classmethod
+    def parse_cached(cls, settings: dict) -> 'IntegrationModel':
+        """ parse_obj memoized by settings fingerprint, returned instances are shared and must not be mutated """
+        if isinstance(settings, cls):
+            return settings
+        key = settings_fingerprint(settings)
+        parsed = _settings_cache.get(key)
+        if parsed is None:
+            parsed = cls.parse_obj(settings)
+            _settings_cache.set(key, parsed)
+        return parsed
+
+    def __setattr__(self, name, value):
+        if name == 'models':
+            object.__setattr__(self, '_model_index', None)
+        if name in ('endpoints', 'api_base', 'api_token', 'api_type', 'api_version'):
+            object.__setattr__(self, '_endpoint_list', None)
+        super().__setattr__(name, value)
+
+    @property
+    def endpoint_list(self) -> tuple:
+        """ Declared endpoints, or the single api_base/api_token endpoint when none are declared """
+        if self._endpoint_list is None:
+            endpoints = tuple(self.endpoints) or (EndpointModel(
+                api_base=self.api_base,
+                api_token=self.api_token,
+                api_type=self.api_type,
+                api_version=self.api_version,
+            ),)
+            object.__setattr__(self, '_endpoint_list', endpoints)
+        return self._endpoint_list
+
+    @property
+    def model_index(self) -> Mapping[str, AIModel]:
+        """ Read-only id/name -> AIModel mapping, ids win over names, first model wins on duplicates """
+        if self._model_index is None:
+            index = {}
+            for model in reversed(self.models):
+                index[model.name] = model
+            for model in reversed(self.models):
+                index[model.id] = model
+            object.__setattr__(self, '_model_index', MappingProxyType(index))
+        return self._model_index
+
+    def get_model(self, model_name: str) -> Optional[AIModel]:
+        return self.model_index.get(model_name)
+
+    @property
+    def model(self) -> Optional[AIModel]:
+        return self.get_model(self.model_name)
+
     @property
     def token_limit(self):
-        return next((model.token_limit for model in self.models if model.id == self.model_name), 8096)
+        return self.get_token_limit(self.model_name)
 
     def get_token_limit(self, model_name):
-        return next((model.token_limit for model in self.models if model.id == model_name), 8096)
+        model = self.get_model(model_name)
+        return model.token_limit if model is not None else context_window(model_name)
 
     def check_connection(self, project_id=None):
         if not project_id:
@@ -22,7 +22,17 @@ from pylon.core.tools import module
 
 from tools import VaultClient, worker_client  # pylint: disable=E0611,E0401
 
-from .models.integration_pd import IntegrationModel
+from . import runtime
+from .batch import batch_jobs
+from .bulk_tokens import bulk_counter
+from .circuit import circuit_breakers
+from .clients import client_registry
+from .embedding_cache import embedding_cache
+from .model_registry import LEGACY_TOKEN_LIMITS, token_limits
+from .response_cache import response_cache
+from .usage_ledger import usage_ledger
+from .utils import conversations
+from .models.integration_pd import IntegrationModel, cache_vault_settings, invalidate_vault_cache
 
 
 CAPATIBILITIES_MAP = {
@@ -35,23 +45,7 @@ CAPATIBILITIES_MAP = {
         ['text-embedding-ada-002']
 }
 
-TOKEN_LIMITS = {
-    'gpt-3.5-turbo-instruct': 4097,
-    'babbage-002': 16384,
-    'davinci-002': 16384,
-    'gpt-4': 8192,
-    'gpt-4-0613': 8192,
-    'gpt-4-32k': 32768,
-    'gpt-4-32k-0613': 32768,
-    'gpt-3.5-turbo': 4097,
-    'gpt-3.5-turbo-0613': 4097,
-    'gpt-3.5-turbo-16k': 16385,
-    'gpt-3.5-turbo-16k-0613': 16385,
-    'text-embedding-ada-002': None,
-    'text-davinci-003': 4097,
-    'text-davinci-002': 4097,
-    'code-davinci-002': 8001
-}
+TOKEN_LIMITS = token_limits()
 
 
 class Module(module.ModuleModel):
@@ -68,6 +62,15 @@ class Module(module.ModuleModel):
         #
         self.descriptor.init_all()
         #
+        client_registry.configure(**self.descriptor.config.get('client_pool', {}))
+        circuit_breakers.configure(**self.descriptor.config.get('circuit_breaker', {}))
+        embedding_cache.configure(**self.descriptor.config.get('embedding_cache', {}))
+        response_cache.configure(**self.descriptor.config.get('response_cache', {}))
+        usage_ledger.configure(**self.descriptor.config.get('usage_ledger', {}))
+        batch_jobs.configure(**self.descriptor.config.get('batch', {}))
+        bulk_counter.configure(**self.descriptor.config.get('bulk_tokens', {}))
+        conversations.configure(**self.descriptor.config.get('conversations', {}))
+        #
         self.context.rpc_manager.call.integrations_register_section(
             name=SECTION_NAME,
             integration_description='Manage ai integrations',
@@ -83,9 +86,16 @@ class Module(module.ModuleModel):
         if 'open_ai_capatibilities_map' not in secrets:
             secrets['open_ai_capatibilities_map'] = json.dumps(CAPATIBILITIES_MAP)
             vault_client.set_secrets(secrets)
-        if 'open_ai_token_limits' not in secrets:
-            secrets['open_ai_token_limits'] = json.dumps(TOKEN_LIMITS)
+        limits = json.loads(secrets.get('open_ai_token_limits', '{}'))
+        outdated = {
+            name: limit for name, limit in TOKEN_LIMITS.items()
+            if name not in limits or (limits[name] == LEGACY_TOKEN_LIMITS.get(name) and limits[name] != limit)
+        }
+        if outdated:
+            log.info('Updating token limits of %s models', len(outdated))
+            secrets['open_ai_token_limits'] = json.dumps({**limits, **outdated})
             vault_client.set_secrets(secrets)
+        cache_vault_settings(secrets)
         #
         worker_client.register_integration(
             integration_name=self.descriptor.name,
@@ -109,5 +119,14 @@ class Module(module.ModuleModel):
     def deinit(self):
         """ De-init module """
         log.info('De-initializing')
+        invalidate_vault_cache()
+        if runtime.is_running():
+            runtime.run(batch_jobs.aclose())
+            runtime.run(client_registry.aclose())
+        runtime.shutdown()
+        embedding_cache.close()
+        response_cache.close()
+        usage_ledger.close()
+        bulk_counter.shutdown()
         #
         self.descriptor.deinit_all()
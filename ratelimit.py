@@ -0,0 +1,165 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+PRIORITIES = {
+    'interactive': 0,
+    'batch': 1,
+}
+
+
+class TokenBucket:
+    """ Refills continuously up to a per-minute capacity """
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.available = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # a single request larger than the whole bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+    def resize(self, per_minute: int):
+        self._refill(time.monotonic())
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = min(self.available, per_minute)
+
+
+class RateLimiter:
+    """ Requests-per-minute and tokens-per-minute buckets with a priority queue, used from the shared loop """
+
+    def __init__(self, rpm: int | None, tpm: int | None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._buckets = []
+        if rpm:
+            self._buckets.append((TokenBucket(rpm), False))
+        if tpm:
+            self._buckets.append((TokenBucket(tpm), True))
+        self._queue = []
+        self._sequence = itertools.count()
+        self._dispatcher = None
+        self._wakeup = asyncio.Event()
+        self.granted = 0
+        self.waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def update(self, rpm: int | None, tpm: int | None):
+        """ Apply changed limits in place, queued waiters keep their place and are re-evaluated """
+        if (rpm, tpm) == (self.rpm, self.tpm):
+            return
+        current = {by_tokens: bucket for bucket, by_tokens in self._buckets}
+        self._buckets = []
+        for limit, by_tokens in ((rpm, False), (tpm, True)):
+            if not limit:
+                continue
+            bucket = current.get(by_tokens)
+            if bucket is None:
+                bucket = TokenBucket(limit)
+            else:
+                bucket.resize(limit)
+            self._buckets.append((bucket, by_tokens))
+        self.rpm = rpm
+        self.tpm = tpm
+        self._wakeup.set()
+
+    def _wait_time(self, cost: int, now: float) -> float:
+        return max(
+            (bucket.wait_time(cost if by_tokens else 1, now) for bucket, by_tokens in self._buckets),
+            default=0.0,
+        )
+
+    def _take(self, cost: int):
+        for bucket, by_tokens in self._buckets:
+            bucket.take(cost if by_tokens else 1)
+        self.granted += 1
+
+    async def acquire(self, cost: int, priority: str = 'interactive') -> float:
+        """ Wait for budget, returns seconds waited """
+        if not self._queue and self._wait_time(cost, time.monotonic()) <= 0:
+            self._take(cost)
+            return 0.0
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (PRIORITIES.get(priority, 0), next(self._sequence), cost, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        else:
+            self._wakeup.set()  # re-evaluate in case the new waiter jumped the queue
+        await future
+        waited = time.monotonic() - started
+        self.waited += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return waited
+
+    async def _dispatch(self):
+        while self._queue:
+            _, _, cost, future = self._queue[0]
+            if future.done():  # waiter was cancelled
+                heapq.heappop(self._queue)
+                continue
+            wait = self._wait_time(cost, time.monotonic())
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._queue)
+            self._take(cost)
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        depth = {name: 0 for name in PRIORITIES}
+        names = {value: name for name, value in PRIORITIES.items()}
+        for priority, _, _, future in list(self._queue):
+            if not future.done():
+                depth[names.get(priority, 'interactive')] += 1
+        return {
+            'rpm': self.rpm,
+            'tpm': self.tpm,
+            'queue_depth': depth,
+            'granted': self.granted,
+            'waited': self.waited,
+            'wait_avg': self.wait_total / self.waited if self.waited else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+
+_limiters = {}
+
+
+def get_limiter(api_base: str, model: str, rpm: int | None, tpm: int | None) -> RateLimiter | None:
+    if not rpm and not tpm:
+        return None
+    # one limiter per deployment, so integrations sharing it never exceed its quota together;
+    # changed limits are applied in place rather than replacing it, which would orphan its waiters
+    limiter = _limiters.get((api_base, model))
+    if limiter is None:
+        limiter = _limiters[(api_base, model)] = RateLimiter(rpm, tpm)
+    else:
+        limiter.update(rpm, tpm)
+    return limiter
+
+
+def stats() -> dict:
+    return {f'{api_base} {model}': limiter.stats() for (api_base, model), limiter in list(_limiters.items())}
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from pylon.core.tools import log
+
+from .caches import TTLCache
+
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'open_ai', 'responses.sqlite3')
+
+
+def make_key(*parts) -> str:
+    """ Canonical hash of JSON-able request parts """
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def is_deterministic(params: dict) -> bool:
+    return params.get('temperature') == 0 and not params.get('stream') and params.get('n', 1) == 1
+
+
+class MemoryBackend:
+    """ Values are kept serialized so callers never share a mutable response """
+    blocking = False
+
+    def __init__(self, maxsize: int = 1024):
+        self._cache = TTLCache(maxsize=maxsize)
+
+    def get(self, key: str):
+        value = self._cache.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value, ttl: float):
+        self._cache.set(key, json.dumps(value), ttl=ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+    def close(self):
+        pass
+
+    @property
+    def size(self) -> int:
+        return len(self._cache)
+
+
+class DiskBackend:
+    blocking = True
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires REAL NOT NULL, value TEXT NOT NULL)'
+        )
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value FROM responses WHERE key = ? AND expires > ?', (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value, ttl: float):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?)', (key, time.time() + ttl, json.dumps(value))
+            )
+            self._connection.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM responses')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'disk': DiskBackend,
+}
+
+
+class ResponseCache:
+    """ Response cache with pluggable backend, blocking backends run in the default executor """
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, backend: str = 'memory', **kwargs):
+        self.backend.close()
+        self.backend = BACKENDS[backend](**kwargs)
+        log.info('Response cache backend: %s', backend)
+
+    async def _call(self, func, *args):
+        if self.backend.blocking:
+            return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+        return func(*args)
+
+    async def get(self, key: str):
+        value = await self._call(self.backend.get, key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value, ttl: float):
+        await self._call(self.backend.set, key, value, ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+    def close(self):
+        self.backend.close()
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'size': self.backend.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache()
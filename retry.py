@@ -0,0 +1,161 @@
+import asyncio
+import random
+import re
+import time
+from collections import Counter, deque
+from email.utils import parsedate_to_datetime
+
+import openai
+from pylon.core.tools import log
+
+
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+RESET_HEADERS = ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUSES or error.status_code >= 500
+    return False
+
+
+def parse_duration(value: str) -> float | None:
+    """ '1s', '6m0s', '20ms' style durations used by x-ratelimit-reset-* """
+    matches = _DURATION.findall(value)
+    if not matches:
+        return None
+    return sum(float(amount) * _UNITS[unit] for amount, unit in matches)
+
+
+def retry_after(error: BaseException) -> float | None:
+    """ Server requested delay from Retry-After / x-ratelimit-reset-* headers """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    if value := headers.get('retry-after-ms'):
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    if value := headers.get('retry-after'):
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    resets = [parse_duration(headers[name]) for name in RESET_HEADERS if headers.get(name)]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+class RetryStats:
+    """ Counters and a bounded log of recent attempts """
+
+    def __init__(self, history: int = 256):
+        self.calls = 0
+        self.retries = 0
+        self.give_ups = 0
+        self.errors = Counter()
+        self.recent = deque(maxlen=history)
+
+    def record(self, label: str, attempt: int, error: BaseException, delay: float | None):
+        name = type(error).__name__
+        self.errors[name] += 1
+        if delay is None:
+            self.give_ups += 1
+        else:
+            self.retries += 1
+        self.recent.append({
+            'time': time.time(),
+            'label': label,
+            'attempt': attempt,
+            'error': name,
+            'status': getattr(error, 'status_code', None),
+            'delay': delay,
+        })
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'give_ups': self.give_ups,
+            'errors': dict(self.errors),
+            'recent': list(self.recent)[-20:],
+        }
+
+
+retry_stats = RetryStats()
+
+
+class Deadline:
+    """ Retry budget in seconds, running from creation or, with lazy=True, from the first start() """
+
+    def __init__(self, seconds: float, lazy: bool = False):
+        self.seconds = seconds
+        self.at = None if lazy else time.monotonic() + seconds
+
+    def start(self):
+        if self.at is None:
+            self.at = time.monotonic() + self.seconds
+
+    @property
+    def remaining(self) -> float:
+        return self.seconds if self.at is None else self.at - time.monotonic()
+
+
+class DeadlineExceeded(Exception):
+    """ Raised by an attempt that can not reach upstream before the deadline, ends the retries """
+
+
+async def call_with_retry(
+        func, max_retries: int, deadline: float | Deadline, base_delay: float = 0.5, max_delay: float = 20.0,
+        label: str = '', bound_attempts: bool = True
+        ):
+    """
+    Await func() again on retryable errors with decorrelated jitter, within a total deadline.
+    The deadline bounds the attempts too (clients run with openai's 600s default timeout),
+    unless bound_attempts=False for callers that time their attempts out themselves.
+    An attempt raising DeadlineExceeded ends the retries with the previous attempt's error
+    """
+    if not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline)
+    delay = base_delay
+    attempt = 0
+    error = None
+    retry_stats.calls += 1
+    while True:
+        try:
+            if not bound_attempts:
+                return await func()
+            return await asyncio.wait_for(func(), max(deadline.remaining, 0.0))
+        except DeadlineExceeded:
+            if error is None:
+                raise
+            retry_stats.record(label, attempt, error, None)
+            raise error from None
+        except Exception as e:  # pylint: disable=W0703
+            attempt += 1
+            error = e
+            remaining = deadline.remaining
+            if not is_retryable(e) or attempt > max_retries:
+                if is_retryable(e):
+                    retry_stats.record(label, attempt, e, None)
+                raise
+            hint = retry_after(e)
+            if hint is not None:
+                delay = hint + random.uniform(0, base_delay)
+            else:
+                delay = min(max_delay, random.uniform(base_delay, delay * 3))
+            if delay > remaining:
+                retry_stats.record(label, attempt, e, None)
+                raise
+            retry_stats.record(label, attempt, e, delay)
+            log.warning('%s attempt %s failed with %s, retrying in %.2fs', label, attempt, type(e).__name__, delay)
+            await asyncio.sleep(delay)
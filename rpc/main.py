@@ -4,28 +4,49 @@ from traceback import format_exc
 from tools import rpc_tools, worker_client, this, SecretString
 from pydantic.v1 import ValidationError
 
-from ..models.integration_pd import OpenAISettings, AIModel
-from ..utils import predict_chat, predict_text, predict_chat_from_request, predict_from_request
+from .. import batch, descriptors, hedging, metrics, ratelimit, runtime
+from ..bulk_tokens import bulk_counter
+from ..circuit import CircuitOpenError, circuit_breakers
+from ..clients import client_registry
+from ..embedding_cache import embedding_cache
+from ..endpoints import endpoint_pool
+from ..embeddings import embed_documents, embed_query
+from ..response_cache import response_cache
+from ..retry import retry_stats
+from ..singleflight import single_flight
+from ..streams import ResponseStream, stream_registry
+from ..usage_ledger import usage_ledger
+from ..models.integration_pd import (
+    IntegrationModel, OpenAISettings, AIModel, invalidate_vault_cache, vault_cache_stats, settings_cache_stats
+)
+from ..utils import (
+    conversations, count_tokens as count_tokens_locally, is_known_model, predict_chat, predict_text,
+    predict_chat_from_request, predict_from_request, token_cache_stats
+)
 
 class RPC:
     integration_name = 'open_ai'
 
     @web.rpc(f'{integration_name}__predict')
     @rpc_tools.wrap_exceptions(RuntimeError)
-    def predict(self, project_id, settings, prompt_struct):
+    @metrics.timed_rpc
+    def predict(self, project_id, settings, prompt_struct, priority='interactive'):
         """ Predict function """
-        models = settings.get('models', [])
-        capabilities = next((model['capabilities'] for model in models if model['id'] == settings['model_name']), {})
-
         try:
-            if capabilities.get('chat_completion'):
-                log.info('Using chat prediction for model: %s', settings['model_name'])
-                result = predict_chat(project_id, settings, prompt_struct)
-            elif capabilities.get('completion'):
-                log.info('Using completion(text) prediction for model: %s', settings['model_name'])
-                result = predict_text(project_id, settings, prompt_struct)
+            settings = IntegrationModel.parse_cached(settings)
+            circuit_breakers.check(settings, settings.model_name)
+            model = settings.model
+            if model is not None and model.supports('chat_completion'):
+                log.info('Using chat prediction for model: %s', settings.model_name)
+                result = predict_chat(project_id, settings, prompt_struct, priority)
+            elif model is not None and model.supports('completion'):
+                log.info('Using completion(text) prediction for model: %s', settings.model_name)
+                result = predict_text(project_id, settings, prompt_struct, priority)
             else:
-                raise Exception(f"Model {settings['model_name']} does not support chat or text completion")
+                raise Exception(f"Model {settings.model_name} does not support chat or text completion")
+        except CircuitOpenError as e:
+            log.warning(str(e))
+            return {"ok": False, "error": str(e), "retry_after": e.retry_after}
         except Exception as e:
             log.error(format_exc())
             return {"ok": False, "error": f"{type(e)}: {str(e)}"}
@@ -34,30 +55,161 @@ class RPC:
 
     @web.rpc(f'{integration_name}__chat_completion')
     @rpc_tools.wrap_exceptions(RuntimeError)
-    def chat_completion(self, project_id, settings, request_data):
+    @metrics.timed_rpc
+    def chat_completion(self, project_id, settings, request_data, priority='interactive'):
         """ Chat completion function """
         try:
-            result = predict_chat_from_request(project_id, settings, request_data)
+            circuit_breakers.check(IntegrationModel.parse_cached(settings), request_data.get('model'))
+            result = predict_chat_from_request(project_id, settings, request_data, priority)
+        except CircuitOpenError as e:
+            log.warning(str(e))
+            return {"ok": False, "error": str(e), "retry_after": e.retry_after}
         except Exception as e:
             log.error(str(e))
             return {"ok": False, "error": f"{str(e)}"}
 
+        if isinstance(result, ResponseStream):
+            return {"ok": True, "stream_id": result.id}
         return {"ok": True, "response": result}
 
     @web.rpc(f'{integration_name}__completion')
     @rpc_tools.wrap_exceptions(RuntimeError)
-    def completion(self, project_id, settings, request_data):
+    @metrics.timed_rpc
+    def completion(self, project_id, settings, request_data, priority='interactive'):
         """ Completion function """
         try:
-            result = predict_from_request(project_id, settings, request_data)
+            circuit_breakers.check(IntegrationModel.parse_cached(settings), request_data.get('model'))
+            result = predict_from_request(project_id, settings, request_data, priority)
+        except CircuitOpenError as e:
+            log.warning(str(e))
+            return {"ok": False, "error": str(e), "retry_after": e.retry_after}
         except Exception as e:
             log.error(str(e))
             return {"ok": False, "error": f"{str(e)}"}
 
+        if isinstance(result, ResponseStream):
+            return {"ok": True, "stream_id": result.id}
+        return {"ok": True, "response": result}
+
+    @web.rpc(f'{integration_name}__embed_documents')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def embed_documents(self, project_id, settings, texts, model_name=None):
+        """ Embed texts in concurrent batches, vectors keep the input order """
+        try:
+            result = embed_documents(project_id, settings, texts, model_name)
+        except Exception as e:
+            log.error(format_exc())
+            return {"ok": False, "error": f"{type(e)}: {str(e)}"}
+
         return {"ok": True, "response": result}
 
+    @web.rpc(f'{integration_name}__embed_query')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def embed_query(self, project_id, settings, text, model_name=None):
+        """ Embed a single text """
+        try:
+            result = embed_query(project_id, settings, text, model_name)
+        except Exception as e:
+            log.error(format_exc())
+            return {"ok": False, "error": f"{type(e)}: {str(e)}"}
+
+        return {"ok": True, "response": result}
+
+    @web.rpc(f'{integration_name}__count_tokens')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def count_tokens(self, settings, data):
+        """ Same as the count_tokens worker callback, counted in-process for chat models tiktoken knows """
+        model_name = settings.merged_settings["model_name"]
+        if is_known_model(model_name) and not descriptors.get_template(settings.merged_settings).legacy_completion:
+            try:
+                return count_tokens_locally(data, model_name)
+            except TypeError:
+                log.debug('Counting %s tokens in the worker, data is not plain text', model_name)
+        return worker_client.ai_count_tokens(integration_name=this.module_name, settings=settings, data=data)
+
+    @web.rpc(f'{integration_name}__count_tokens_bulk')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def count_tokens_bulk(self, texts, model_name):
+        """ array('I') of token counts of an iterable of texts, in order, tokenized in a process pool """
+        return bulk_counter.count(texts, model_name)
+
+    @web.rpc(f'{integration_name}__batch_submit')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def batch_submit(
+            self, project_id, settings, items, mode='predict', custom_ids=None, completion_window='24h', metadata=None
+            ):
+        """ Submit prompt_structs (mode=predict) or chat_completion/completion request bodies to the Batch API """
+        try:
+            result = batch.submit(
+                project_id, settings, items, mode,
+                custom_ids=custom_ids, completion_window=completion_window, metadata=metadata,
+            )
+        except Exception as e:
+            log.error(format_exc())
+            return {"ok": False, "error": f"{type(e)}: {str(e)}"}
+
+        return {"ok": True, **result}
+
+    @web.rpc(f'{integration_name}__batch_results')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def batch_results(self, project_id, batch_id, cursor=0, limit=1000):
+        """ Status and next page of per custom_id results of a batch of the project """
+        try:
+            result = batch.batch_jobs.results(project_id, batch_id, cursor, limit)
+        except KeyError as e:
+            return {"ok": False, "error": e.args[0]}
+        return {"ok": True, **result}
+
+    @web.rpc(f'{integration_name}__batch_cancel')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def batch_cancel(self, project_id, batch_id):
+        """ Cancel a batch of the project, requests already completed still produce results """
+        try:
+            result = batch.cancel(project_id, batch_id)
+        except KeyError as e:
+            return {"ok": False, "error": e.args[0]}
+        except Exception as e:
+            log.error(format_exc())
+            return {"ok": False, "error": f"{type(e)}: {str(e)}"}
+        return {"ok": True, **result}
+
+    @web.rpc(f'{integration_name}__stream_read')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def stream_read(self, stream_id, max_chunks=64, timeout=30):
+        """ Next buffered chunks of a streamed completion, waits up to timeout for the first one """
+        try:
+            result = runtime.run(stream_registry.read(stream_id, max_chunks, timeout))
+        except KeyError as e:
+            return {"ok": False, "error": e.args[0]}
+        if "error" in result:
+            return {"ok": False, "chunks": result["chunks"], "done": True, "error": result["error"]}
+        return {"ok": True, **result}
+
+    @web.rpc(f'{integration_name}__stream_close')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def stream_close(self, stream_id):
+        """ Cancel a streamed completion """
+        return {"ok": runtime.run(stream_registry.close(stream_id))}
+
+    @web.rpc(f'{integration_name}__conversation_close')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def conversation_close(self, conversation_id):
+        """ Drop the token counts kept for a chat session """
+        return {"ok": conversations.close(conversation_id)}
+
     @web.rpc(f'{integration_name}__parse_settings')
     @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
     def parse_settings(self, settings):
         try:
             settings = OpenAISettings.parse_obj(settings)
@@ -65,8 +217,76 @@ class RPC:
             return {"ok": False, "error": e}
         return {"ok": True, "item": settings}
 
+    @web.rpc(f'{integration_name}__invalidate_vault_cache')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def invalidate_vault_cache(self):
+        """ Drop cached capabilities map, token limits, parsed settings and unsecreted tokens """
+        invalidate_vault_cache()
+        descriptors.clear()
+
+    @web.rpc(f'{integration_name}__cache_stats')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def cache_stats(self):
+        """ Hit/miss counters of in-process caches """
+        return {
+            "tokens": token_cache_stats(),
+            "conversations": conversations.stats,
+            "vault": vault_cache_stats(),
+            "settings": settings_cache_stats(),
+            "descriptors": descriptors.stats(),
+            "embeddings": embedding_cache.stats,
+            "responses": response_cache.stats,
+        }
+
+    @web.rpc(f'{integration_name}__in_flight')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def in_flight(self):
+        """ In-flight and waiting upstream requests per (project_id, api_base) """
+        return {
+            "limits": runtime.stats(),
+            "clients": client_registry.stats(),
+            "streams": stream_registry.stats(),
+            "coalesced": single_flight.stats(),
+            "rate_limits": ratelimit.stats(),
+            "retries": retry_stats.stats(),
+            "endpoints": endpoint_pool.stats(),
+            "hedges": hedging.stats(),
+        }
+
+    @web.rpc(f'{integration_name}__circuit_state')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def circuit_state(self):
+        """ State, failure rate and rejections of circuit breakers per (api_base, model) """
+        return circuit_breakers.stats()
+
+    @web.rpc(f'{integration_name}__reset_circuit_breakers')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def reset_circuit_breakers(self):
+        """ Close all circuits, e.g. after an upstream incident is resolved """
+        circuit_breakers.reset()
+
+    @web.rpc(f'{integration_name}__usage')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def usage(self, project_id=None, model=None, integration=None, since=None, until=None, granularity=None):
+        """ Token usage summed per (project_id, model, integration), optionally per time window """
+        return usage_ledger.query(project_id, model, integration, since, until, granularity)
+
+    @web.rpc(f'{integration_name}__metrics')
+    @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
+    def prometheus_metrics(self):
+        """ Latency histograms and token counters in Prometheus text format """
+        return metrics.render()
+
     @web.rpc(f'{integration_name}_set_models', 'set_models')
     @rpc_tools.wrap_exceptions(RuntimeError)
+    @metrics.timed_rpc
     def set_models(self, payload: dict):
         if isinstance(payload['settings'].get('api_token', {}), SecretString):
             token_field = payload['settings'].get('api_token')
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from pylon.core.tools import log
+
+
+_loop = None
+_thread = None
+_lock = threading.Lock()
+_limits = {}
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """ Shared event loop running in a daemon thread, started on first use """
+    global _loop, _thread  # pylint: disable=W0603
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='open_ai-asyncio', daemon=True)
+                thread.start()
+                _loop, _thread = loop, thread
+                log.info('Started open_ai event loop')
+    return _loop
+
+
+def is_running() -> bool:
+    return _loop is not None
+
+
+def submit(coro) -> Future:
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro, timeout: float | None = None):
+    """ Run a coroutine on the shared loop and block the calling thread for its result """
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+
+
+class InFlightLimit:
+    """ FIFO concurrency limit with visible counters, the limit can change while calls hold or wait for slots """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(not waiter.done() for waiter in self._waiters)
+
+    def resize(self, limit: int):
+        self.limit = limit
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():  # skips waiters that were cancelled
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def __aenter__(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return self
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():  # the slot was granted as the caller was cancelled
+                self.in_flight -= 1
+                self._wake()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._wake()
+
+
+def in_flight_limit(key, limit: int) -> InFlightLimit:
+    """ Per-key concurrency limit, must be used from the shared loop """
+    # a changed limit is applied in place, callers holding or waiting for slots keep them
+    current = _limits.get(key)
+    if current is None:
+        current = _limits[key] = InFlightLimit(limit)
+    elif current.limit != limit:
+        current.resize(limit)
+    return current
+
+
+def stats() -> dict:
+    return {
+        str(key): {'limit': item.limit, 'in_flight': item.in_flight, 'waiting': item.waiting}
+        for key, item in list(_limits.items())
+    }
+
+
+async def _cancel_pending():
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def shutdown(timeout: float = 10):
+    global _loop, _thread  # pylint: disable=W0603
+    with _lock:
+        loop, thread = _loop, _thread
+        _loop, _thread = None, None
+    if loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_cancel_pending(), loop).result(timeout)
+    except Exception:  # pylint: disable=W0703
+        log.exception('Failed to cancel pending open_ai tasks')
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout)
+    if not thread.is_alive():
+        loop.close()
+    _limits.clear()
@@ -0,0 +1,39 @@
+import asyncio
+import copy
+
+
+class SingleFlight:
+    """ Concurrent calls with the same key share one upstream call, used from the shared loop """
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def _done(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved, every waiter gets it re-raised
+
+    async def do(self, key, func):
+        """ Await func() or join an identical call already in flight, followers get a copy of the result """
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            # the call runs as its own task so a cancelled waiter never cancels the others
+            task = self._calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda done: self._done(key, done))
+            return await asyncio.shield(task)
+        self.shared += 1
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._calls),
+            'calls': self.calls,
+            'shared': self.shared,
+        }
+
+
+single_flight = SingleFlight()
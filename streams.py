@@ -0,0 +1,136 @@
+import asyncio
+import time
+from uuid import uuid4
+
+from pylon.core.tools import log
+
+from . import runtime
+
+
+STREAM_BUFFER_SIZE = 256
+STREAM_IDLE_TIMEOUT = 300.0
+STREAM_SWEEP_INTERVAL = 30.0
+
+_END = object()
+
+
+class ResponseStream:
+    """ Pumps an async iterator into a bounded queue, a full queue pauses the upstream read """
+
+    def __init__(self, source, maxsize: int = STREAM_BUFFER_SIZE):
+        self.id = uuid4().hex
+        self.error = None
+        self.finished = False
+        self.last_read = time.monotonic()
+        self._queue = asyncio.Queue(maxsize)
+        self._task = asyncio.get_running_loop().create_task(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for item in source:
+                await self._queue.put(item)
+        except asyncio.CancelledError:
+            # close the source now rather than at garbage collection, it holds the in-flight slot and connection
+            if hasattr(source, 'aclose'):
+                await source.aclose()
+            raise
+        except Exception as e:  # pylint: disable=W0703
+            log.error('Stream %s failed: %s', self.id, e)
+            self.error = e
+        await self._queue.put(_END)
+
+    async def read(self, max_chunks: int = 64, timeout: float = 30.0) -> dict:
+        """ Wait up to timeout for the first chunk, then drain what is already buffered """
+        self.last_read = time.monotonic()
+        chunks = []
+        if not self.finished:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+            while item is not None:
+                if item is _END:
+                    self.finished = True
+                    break
+                chunks.append(item)
+                if len(chunks) >= max_chunks or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+        result = {'chunks': chunks, 'done': self.finished}
+        if self.finished and self.error is not None:
+            result['error'] = f'{type(self.error)}: {self.error}'
+        return result
+
+    def cancel(self):
+        self._task.cancel()
+
+
+class StreamRegistry:
+    """ Open response streams by id, used from the shared loop """
+
+    def __init__(self, idle_timeout: float = STREAM_IDLE_TIMEOUT, sweep_interval: float = STREAM_SWEEP_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self._streams = {}
+        self._sweep = None
+
+    def open(self, source, maxsize: int = STREAM_BUFFER_SIZE) -> ResponseStream:
+        self.evict_idle()
+        stream = ResponseStream(source, maxsize)
+        self._streams[stream.id] = stream
+        self._schedule_sweep()
+        return stream
+
+    def _schedule_sweep(self):
+        """ Periodic eviction while streams are open, an abandoned stream holds its slot and connection """
+        loop = asyncio.get_running_loop()
+        if self._sweep is not None and self._sweep[0] is loop:
+            return
+        self._sweep = (loop, loop.call_later(self.sweep_interval, self._run_sweep))
+
+    def _run_sweep(self):
+        self._sweep = None
+        self.evict_idle()
+        if self._streams:
+            self._schedule_sweep()
+
+    async def read(self, stream_id: str, max_chunks: int = 64, timeout: float = 30.0) -> dict:
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            raise KeyError(f'Unknown stream: {stream_id}')
+        result = await stream.read(max_chunks, timeout)
+        if result['done']:
+            self._streams.pop(stream_id, None)
+        return result
+
+    async def close(self, stream_id: str) -> bool:
+        stream = self._streams.pop(stream_id, None)
+        if stream is None:
+            return False
+        stream.cancel()
+        return True
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for stream_id, stream in list(self._streams.items()):
+            if now - stream.last_read > self.idle_timeout:
+                log.warning('Closing abandoned stream %s', stream_id)
+                del self._streams[stream_id]
+                stream.cancel()
+
+    def stats(self) -> dict:
+        return {'open': len(self._streams)}
+
+
+stream_registry = StreamRegistry()
+
+
+def iter_stream(stream_id: str, max_chunks: int = 64, timeout: float = 30.0):
+    """ Blocking generator over stream chunks for in-process callers """
+    while True:
+        result = runtime.run(stream_registry.read(stream_id, max_chunks, timeout))
+        yield from result['chunks']
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        if result['done']:
+            return
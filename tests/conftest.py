@@ -0,0 +1,128 @@
+""" Imports the plugin as plugins.open_ai outside a pylon runtime, and fakes shared by the tests """
+import asyncio
+import contextvars
+import copy
+import importlib
+import logging
+import sys
+import types
+from pathlib import Path
+
+import httpx
+import openai
+import pytest
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _passthrough(*args, **kwargs):  # pylint: disable=W0613
+    return lambda func: func
+
+
+class _SecretString(str):
+    def unsecret(self, project_id):  # pylint: disable=W0613
+        return str(self)
+
+
+class _VaultClient:
+    secrets = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_all_secrets(self) -> dict:
+        return dict(self.secrets)
+
+    def set_secrets(self, secrets: dict):
+        self.secrets.update(secrets)
+
+
+class _WorkerClient:
+    @staticmethod
+    def unsecret_data(value, project_id):  # pylint: disable=W0613
+        return value
+
+
+def _install_runtime():
+    """ pylon and its runtime-registered `tools` module only exist inside a running pylon """
+    try:
+        importlib.import_module('pylon.core.tools')
+    except ImportError:
+        _module('pylon', __path__=[])
+        _module('pylon.core', __path__=[])
+        _module(
+            'pylon.core.tools', log=logging.getLogger('pylon'),
+            web=types.SimpleNamespace(method=_passthrough, rpc=_passthrough, slot=_passthrough),
+            module=types.SimpleNamespace(ModuleModel=object),
+        )
+    try:
+        importlib.import_module('tools')
+    except ImportError:
+        _module(
+            'tools', SecretString=_SecretString, VaultClient=_VaultClient, worker_client=_WorkerClient(),
+            session_project=contextvars.ContextVar('session_project', default=None),
+            rpc_tools=types.SimpleNamespace(wrap_exceptions=_passthrough),
+            this=types.SimpleNamespace(module_name='open_ai'),
+            api_tools=types.SimpleNamespace(APIModeHandler=object, APIBase=object),
+        )
+
+
+def _install_plugin():
+    """ The checkout as plugins.open_ai, without running module.py (that needs the pylon context) """
+    try:
+        importlib.import_module('plugins.open_ai')
+    except ImportError:
+        plugins = sys.modules.get('plugins') or _module('plugins', __path__=[])
+        plugins.open_ai = _module('plugins.open_ai', __path__=[str(ROOT)])
+
+
+_install_runtime()
+_install_plugin()
+
+
+REQUEST = httpx.Request('POST', 'https://api.example/v1/chat/completions')
+
+
+def status_error(status: int, headers: dict | None = None) -> openai.APIStatusError:
+    response = httpx.Response(status, headers=headers, request=REQUEST)
+    return openai.APIStatusError('upstream error', response=response, body=None)
+
+
+class FakeClient:
+    """
+    Upstream call stand-in: `create` raises the queued errors in order, then returns a copy of `result`.
+    Each call sleeps the next of `delays`, or `delay` once they run out
+    """
+
+    def __init__(self, *errors, delay: float = 0.0, delays: tuple = (), result=None):
+        self.errors = list(errors)
+        self.delay = delay
+        self.delays = list(delays)
+        self.result = {'choices': [{'text': 'hi'}]} if result is None else result
+        self.calls = 0
+        self.cancelled = 0
+
+    async def create(self):
+        self.calls += 1
+        delay = self.delays.pop(0) if self.delays else self.delay
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.errors:
+            raise self.errors.pop(0)
+        return copy.deepcopy(self.result)
+
+
+@pytest.fixture
+def fake_client():
+    return FakeClient
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+
+from plugins.open_ai.batch import BatchJobs, build_requests
+from plugins.open_ai.models.integration_pd import IntegrationModel
+
+
+SETTINGS = IntegrationModel(api_token='sk-test', model_name='gpt-4o-mini', models=[])
+ITEMS = [
+    {'model': 'gpt-4o-mini', 'prompt': 'one'},
+    {'prompt': 'no model'},
+    {'model': 'gpt-4o-mini', 'prompt': 'three'},
+    {'model': 'gpt-4o-mini', 'prompt': 'four'},
+]
+
+
+def _line(custom_id: str, status: int = 200, body: dict | None = None, error: dict | None = None) -> dict:
+    return {
+        'custom_id': custom_id,
+        'response': None if error else {'status_code': status, 'body': body or {}},
+        'error': error,
+    }
+
+
+class FakeTransport:
+    """ Batches API stand-in: the batch completes on the second poll, output lines come back out of order """
+    instances = []
+
+    def __init__(self, endpoint, api_key: str, max_retries: int = 3, deadline: float = 60.0):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.uploaded = None
+        self.polls = 0
+        self.cancelled = False
+        self.instances.append(self)
+
+    async def upload(self, content: bytes) -> str:
+        self.uploaded = [json.loads(line) for line in content.decode().splitlines()]
+        return 'file-in'
+
+    async def create(self, input_file_id: str, url: str, completion_window: str, metadata: dict | None) -> dict:
+        assert input_file_id == 'file-in'
+        return {'id': 'batch-1', 'status': 'validating', 'endpoint': url}
+
+    async def retrieve(self, batch_id: str) -> dict:
+        self.polls += 1
+        if self.polls < 2:
+            return {'id': batch_id, 'status': 'in_progress'}
+        return {'id': batch_id, 'status': 'completed', 'output_file_id': 'file-out', 'error_file_id': 'file-err'}
+
+    async def download(self, file_id: str) -> bytes:
+        if file_id == 'file-out':
+            lines = [
+                _line('3', body={'model': 'gpt-4o-mini', 'choices': [{'text': 'FOUR'}], 'usage': {'total_tokens': 3}}),
+                _line('0', body={'model': 'gpt-4o-mini', 'choices': [{'text': 'ONE'}], 'usage': {'total_tokens': 2}}),
+            ]
+        else:
+            lines = [_line('2', error={'code': 'server_error', 'message': 'boom'})]
+        return '\n'.join(json.dumps(line) for line in lines).encode()
+
+    async def cancel(self, batch_id: str) -> dict:
+        self.cancelled = True
+        return {'id': batch_id, 'status': 'cancelling'}
+
+
+async def _submit(jobs: BatchJobs, project_id: int = 1):
+    kind, requests = build_requests(SETTINGS, ITEMS, 'completion')
+    custom_ids = [str(index) for index in range(len(ITEMS))]
+    return await jobs.submit(
+        project_id, SETTINGS, SETTINGS.endpoint_list[0], 'sk-test', 'completion', kind, requests, custom_ids
+    )
+
+
+def test_submit_poll_download_results_in_input_order():
+    jobs = BatchJobs(transport=FakeTransport, poll_interval=0.01)
+
+    async def run():
+        job = await _submit(jobs)
+        transport = FakeTransport.instances[-1]
+        # the item failing validation never reaches the upload
+        assert [line['custom_id'] for line in transport.uploaded] == ['0', '2', '3']
+        assert transport.uploaded[0]['url'] == '/v1/completions'
+        pending = jobs.results(1, job.id)
+        await job.task
+        return pending, jobs.results(1, job.id, limit=3), jobs.results(1, job.id, cursor=3)
+
+    pending, page, rest = asyncio.run(run())
+    assert not pending['done'] and pending['results'] == []
+    assert page['status'] == 'completed'
+    assert [(result['custom_id'], result['ok']) for result in page['results']] == \
+        [('0', True), ('1', False), ('2', False)]
+    assert page['results'][0]['response']['choices'][0]['text'] == 'ONE'
+    assert 'model' in page['results'][1]['error']
+    assert page['results'][2]['error'] == {'code': 'server_error', 'message': 'boom'}
+    assert not page['done']
+    assert [result['custom_id'] for result in rest['results']] == ['3']
+    assert rest['done'] and rest['cursor'] == 4
+
+
+def test_batch_without_valid_requests_is_not_submitted():
+    jobs = BatchJobs(transport=FakeTransport, poll_interval=0.01)
+    kind, requests = build_requests(SETTINGS, [{'prompt': 'no model'}], 'completion')
+    with pytest.raises(ValueError):
+        asyncio.run(jobs.submit(1, SETTINGS, SETTINGS.endpoint_list[0], 'sk-test', 'completion', kind, requests, ['0']))
+    assert jobs.stats() == {}
+
+
+def test_batches_of_other_projects_are_unknown():
+    jobs = BatchJobs(transport=FakeTransport, poll_interval=0.01)
+
+    async def run():
+        job = await _submit(jobs, project_id=1)
+        with pytest.raises(KeyError):
+            jobs.results(2, job.id)
+        with pytest.raises(KeyError):
+            await jobs.cancel(2, job.id)
+        assert not FakeTransport.instances[-1].cancelled
+        stats = await jobs.cancel('1', job.id)
+        await jobs.aclose()
+        return stats
+
+    assert asyncio.run(run())['status'] == 'cancelling'
+    assert FakeTransport.instances[-1].cancelled
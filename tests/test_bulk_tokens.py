@@ -0,0 +1,55 @@
+import multiprocessing
+import pickle
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+from plugins.open_ai import bulk_tokens
+from plugins.open_ai.bulk_tokens import START_METHOD, BulkTokenCounter, import_worker
+
+
+ENCODING = SimpleNamespace(name='words', encode_ordinary_batch=lambda texts: [text.split() for text in texts])
+
+
+class BreakingExecutor:
+    """ Pool whose workers die after the first chunk """
+
+    def __init__(self):
+        self.submitted = 0
+        self.shut_down = False
+
+    def submit(self, func, encoding_name, chunk):  # pylint: disable=W0613
+        if self.shut_down:
+            raise RuntimeError('cannot schedule new futures after shutdown')
+        self.submitted += 1
+        future = Future()
+        if self.submitted == 1:
+            future.set_result(array('I', (len(text.split()) for text in chunk)).tobytes())
+        else:
+            future.set_exception(BrokenProcessPool('A child process terminated abruptly'))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):  # pylint: disable=W0613
+        self.shut_down = True
+
+
+def test_pool_processes_import_the_worker_outside_the_plugin_package():
+    worker = import_worker()
+    assert worker.__name__ == 'open_ai_token_worker'
+    context = multiprocessing.get_context(START_METHOD)
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        # the child resolves the pickled reference by importing the worker module, then sends it back
+        func = executor.submit(pickle.loads, pickle.dumps(worker.count_chunk)).result(timeout=60)
+    assert func is worker.count_chunk
+
+
+def test_broken_pool_falls_back_to_inline_counting(monkeypatch):
+    monkeypatch.setattr(bulk_tokens, 'get_encoding', lambda model: ENCODING)
+    counter = BulkTokenCounter(processes=2, chunk_size=2)
+    executor = counter._executor = BreakingExecutor()  # pylint: disable=W0212
+    counter._worker = import_worker()  # pylint: disable=W0212
+    texts = [' '.join('w' * (index % 5 + 1)) for index in range(11)]
+    assert list(counter.count(iter(texts), 'gpt-4o')) == [index % 5 + 1 for index in range(11)]
+    assert executor.shut_down
+    assert counter._executor is None  # pylint: disable=W0212
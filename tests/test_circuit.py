@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import pytest
+
+from plugins.open_ai.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreakers, CircuitOpenError
+from plugins.open_ai.models.integration_pd import IntegrationModel
+
+
+API_BASE = 'https://api.example/v1'
+MODEL = 'gpt-4'
+
+
+class UpstreamDown(TimeoutError):
+    """ Retryable, so it counts as an outage """
+
+
+def make_breakers(**options) -> CircuitBreakers:
+    breakers = CircuitBreakers()
+    breakers.configure(**{
+        'failure_rate': 0.5, 'min_requests': 2, 'window': 10.0, 'open_duration': 0.05, 'half_open_probes': 1,
+        **options,
+    })
+    return breakers
+
+
+async def fake_call(breakers, outcome=None, delay: float = 0.0):
+    with breakers.guard(API_BASE, MODEL):
+        await asyncio.sleep(delay)
+        if outcome is not None:
+            raise outcome
+        return 'ok'
+
+
+def trip(breakers):
+    for _ in range(2):
+        with pytest.raises(UpstreamDown):
+            asyncio.run(fake_call(breakers, UpstreamDown()))
+
+
+def test_opens_on_failure_rate_and_fails_fast():
+    breakers = make_breakers()
+    trip(breakers)
+    breaker = breakers.get(API_BASE, MODEL)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(fake_call(breakers))
+    assert breaker.stats()['rejected'] == 1
+    assert breaker.stats()['trips'] == 1
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    breakers = make_breakers()
+    trip(breakers)
+    time.sleep(0.06)
+    breaker = breakers.get(API_BASE, MODEL)
+    assert breaker.state == HALF_OPEN
+
+    async def probe_and_concurrent_call():
+        probe = asyncio.ensure_future(fake_call(breakers, delay=0.02))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError):
+            await fake_call(breakers)
+        return await probe
+
+    assert asyncio.run(probe_and_concurrent_call()) == 'ok'
+    assert breaker.state == CLOSED
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_failed_probe_reopens():
+    breakers = make_breakers()
+    trip(breakers)
+    time.sleep(0.06)
+    with pytest.raises(UpstreamDown):
+        asyncio.run(fake_call(breakers, UpstreamDown()))
+    breaker = breakers.get(API_BASE, MODEL)
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+
+
+def test_cancelled_probe_gives_back_its_slot():
+    breakers = make_breakers()
+    trip(breakers)
+    time.sleep(0.06)
+
+    async def cancel_probe():
+        probe = asyncio.ensure_future(fake_call(breakers, delay=1.0))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        return await fake_call(breakers)
+
+    assert asyncio.run(cancel_probe()) == 'ok'
+    assert breakers.get(API_BASE, MODEL).state == CLOSED
+
+
+def test_client_errors_do_not_trip():
+    breakers = make_breakers()
+    for _ in range(4):
+        with pytest.raises(ValueError):
+            asyncio.run(fake_call(breakers, ValueError('bad request')))
+    assert breakers.get(API_BASE, MODEL).state == CLOSED
+
+
+def test_check_is_read_only():
+    breakers = make_breakers()
+    settings = IntegrationModel(api_base=API_BASE, api_token='sk-test', model_name=MODEL, models=[])
+    breakers.check(settings, MODEL)
+    assert breakers.stats() == {}
+    trip(breakers)
+    with pytest.raises(CircuitOpenError):
+        breakers.check(settings, MODEL)
+    time.sleep(0.06)
+    breakers.check(settings, MODEL)
+    breaker = breakers.get(API_BASE, MODEL)
+    assert breaker._state == OPEN  # pylint: disable=W0212
+    assert breaker.rejected == 0
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from plugins.open_ai.hedging import MIN_SAMPLES, Hedger, hedged
+
+
+SLOW = 0.05
+
+
+def warm_hedger(samples: int = MIN_SAMPLES) -> Hedger:
+    hedger = Hedger()
+    for _ in range(samples):
+        hedger.record(0.001)
+    return hedger
+
+
+def test_no_hedge_until_enough_samples(fake_client):
+    async def run():
+        hedger = Hedger()
+        client = fake_client(delays=(SLOW, 0.0))
+        await hedged(client.create, hedger, 95.0, 1.0)
+        return hedger, client
+
+    hedger, client = asyncio.run(run())
+    assert client.calls == 1
+    assert hedger.hedged == 0
+
+
+def test_hedge_wins_and_cancels_the_slow_call(fake_client):
+    async def run():
+        hedger = warm_hedger()
+        client = fake_client(delays=(SLOW, 0.0))
+        await hedged(client.create, hedger, 95.0, 1.0)
+        await asyncio.sleep(0)
+        return hedger, client
+
+    hedger, client = asyncio.run(run())
+    assert client.calls == 2
+    assert client.cancelled == 1
+    assert hedger.hedged == 1
+    assert hedger.wins == 1
+
+
+def test_budget_caps_the_share_of_hedged_requests(fake_client):
+    async def run():
+        hedger = warm_hedger(400)  # enough fast samples that the slow calls below keep the p95 low
+        calls = 0
+        for _ in range(20):
+            client = fake_client(delays=(0.01, 0.0))
+            await hedged(client.create, hedger, 95.0, 0.25)
+            calls += client.calls
+        return hedger, calls
+
+    hedger, calls = asyncio.run(run())
+    assert hedger.requests == 20
+    assert hedger.hedged == 5
+    assert calls == 25
+
+
+def test_error_is_raised_when_every_call_fails(fake_client):
+    async def run():
+        client = fake_client(RuntimeError('upstream failed'), RuntimeError('upstream failed'), delay=0.01)
+        await hedged(client.create, warm_hedger(), 95.0, 1.0)
+
+    with pytest.raises(RuntimeError, match='upstream failed'):
+        asyncio.run(run())
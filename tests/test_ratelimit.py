@@ -0,0 +1,121 @@
+import asyncio
+
+from plugins.open_ai import ratelimit, runtime
+from plugins.open_ai.ratelimit import RateLimiter
+
+
+def exhaust(limiter: RateLimiter):
+    for bucket, _ in limiter._buckets:  # pylint: disable=W0212
+        bucket.available = 0.0
+
+
+def test_interactive_waiters_are_served_before_batch():
+    async def run():
+        limiter = RateLimiter(rpm=600, tpm=None)  # a request every 0.1s once the bucket is empty
+        exhaust(limiter)
+        order = []
+
+        async def request(name, priority):
+            await limiter.acquire(1, priority)
+            order.append(name)
+
+        tasks = [asyncio.ensure_future(request('batch-1', 'batch'))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(request('batch-2', 'batch')))
+        tasks.append(asyncio.ensure_future(request('interactive-1', 'interactive')))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(request('interactive-2', 'interactive')))
+        await asyncio.gather(*tasks)
+        return order, limiter.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == ['interactive-1', 'interactive-2', 'batch-1', 'batch-2']
+    assert stats['waited'] == 4
+    assert stats['queue_depth'] == {'interactive': 0, 'batch': 0}
+
+
+def test_cancelled_waiter_does_not_consume_budget():
+    async def run():
+        limiter = RateLimiter(rpm=600, tpm=None)
+        exhaust(limiter)
+        cancelled = asyncio.ensure_future(limiter.acquire(1, 'interactive'))
+        waiter = asyncio.ensure_future(limiter.acquire(1, 'batch'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.wait_for(waiter, 1.0)
+        return limiter.granted
+
+    assert asyncio.run(run()) == 1
+
+
+def test_tokens_per_minute_bounds_large_requests():
+    async def run():
+        limiter = RateLimiter(rpm=None, tpm=60000)  # 1000 tokens per second
+        assert await limiter.acquire(60000) == 0.0
+        return await limiter.acquire(100)
+
+    assert 0.05 < asyncio.run(run()) < 0.5
+
+
+def test_integrations_sharing_a_deployment_share_one_limiter():
+    async def run():
+        first = ratelimit.get_limiter('https://shared.example/v1', 'gpt-4', 100, None)
+        second = ratelimit.get_limiter('https://shared.example/v1', 'gpt-4', 120, None)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert (second.rpm, second.tpm) == (120, None)
+
+
+def test_changed_limits_keep_queued_waiters():
+    async def run():
+        limiter = RateLimiter(rpm=6, tpm=None)  # a request every 10s once the bucket is empty
+        exhaust(limiter)
+        waiter = asyncio.ensure_future(limiter.acquire(1, 'batch'))
+        await asyncio.sleep(0.01)
+        limiter.update(6000, 60000)  # raised limits, the queued waiter goes through on the next refill
+        await asyncio.wait_for(waiter, 1.0)
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert (stats['rpm'], stats['tpm']) == (6000, 60000)
+    assert stats['granted'] == 1
+
+
+def test_in_flight_limit_resizes_in_place():
+    async def run():
+        limit = runtime.in_flight_limit(('test', 'resize'), 1)
+        order = []
+
+        async def call(name):
+            async with runtime.in_flight_limit(('test', 'resize'), 2 if name == 'second' else 1):
+                order.append(name)
+                await asyncio.sleep(0.05)
+
+        first = asyncio.ensure_future(call('first'))
+        await asyncio.sleep(0)
+        # the second caller raises the limit, it runs next to the first instead of queueing behind it
+        await asyncio.wait_for(asyncio.gather(first, call('second')), 0.08)
+        return limit, order
+
+    limit, order = asyncio.run(run())
+    assert limit is runtime.in_flight_limit(('test', 'resize'), 2)
+    assert order == ['first', 'second']
+    assert (limit.in_flight, limit.waiting) == (0, 0)
+
+
+def test_cancelled_in_flight_waiter_gives_back_its_slot():
+    async def run():
+        limit = runtime.InFlightLimit(1)
+        await limit.__aenter__()
+        cancelled = asyncio.ensure_future(limit.__aenter__())
+        waiter = asyncio.ensure_future(limit.__aenter__())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await limit.__aexit__(None, None, None)
+        await asyncio.wait_for(waiter, 1.0)
+        return limit
+
+    limit = asyncio.run(run())
+    assert (limit.in_flight, limit.waiting) == (1, 0)
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from plugins.open_ai import ratelimit, utils
+from plugins.open_ai.circuit import circuit_breakers
+from plugins.open_ai.models.integration_pd import IntegrationModel
+from plugins.open_ai.retry import Deadline, DeadlineExceeded, call_with_retry, retry_after
+
+from conftest import status_error
+
+
+def test_retries_retryable_errors_until_success(fake_client):
+    client = fake_client(status_error(503), status_error(429, {'retry-after-ms': '10'}))
+    result = asyncio.run(call_with_retry(client.create, 3, 5.0, base_delay=0.01))
+    assert result == client.result
+    assert client.calls == 3
+
+
+def test_client_errors_are_not_retried(fake_client):
+    client = fake_client(status_error(400))
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(call_with_retry(client.create, 3, 5.0, base_delay=0.01))
+    assert client.calls == 1
+
+
+def test_gives_up_after_max_retries(fake_client):
+    client = fake_client(*(status_error(502) for _ in range(5)))
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(call_with_retry(client.create, 2, 5.0, base_delay=0.01))
+    assert client.calls == 3
+
+
+def test_deadline_bounds_a_hung_attempt(fake_client):
+    client = fake_client(delay=10.0)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(call_with_retry(client.create, 3, 0.1, base_delay=0.01))
+    assert client.calls == 1
+
+
+def test_delay_past_deadline_is_not_slept(fake_client):
+    client = fake_client(status_error(429, {'retry-after': '30'}))
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(call_with_retry(client.create, 3, 1.0, base_delay=0.01))
+    assert client.calls == 1
+
+
+def test_retry_after_headers():
+    assert retry_after(status_error(429, {'retry-after-ms': '250'})) == 0.25
+    assert retry_after(status_error(429, {'retry-after': '2'})) == 2.0
+    assert retry_after(status_error(429, {'x-ratelimit-reset-requests': '1m30s'})) == 90.0
+    assert retry_after(status_error(503)) is None
+
+
+def test_lazy_deadline_starts_at_admission(fake_client):
+    client = fake_client(status_error(503))
+    deadline = Deadline(0.3, lazy=True)
+
+    async def attempt():
+        if deadline.at is None:
+            await asyncio.sleep(0.4)  # queued behind a rate limiter, longer than the whole budget
+            deadline.start()
+        return await client.create()
+
+    assert asyncio.run(call_with_retry(attempt, 3, deadline, base_delay=0.01, bound_attempts=False)) == client.result
+    assert client.calls == 2
+
+
+def test_attempt_past_the_deadline_raises_the_previous_error(fake_client):
+    client = fake_client(status_error(503))
+
+    async def attempt():
+        if client.calls:
+            raise DeadlineExceeded()
+        return await client.create()
+
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(call_with_retry(attempt, 3, 5.0, base_delay=0.01))
+    assert client.calls == 1
+
+
+def test_retry_queued_past_the_deadline_does_not_reach_upstream(fake_client, monkeypatch):
+    client = fake_client(*(status_error(503) for _ in range(5)))
+    upstream = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **params: client.create()
+    )))
+
+    @asynccontextmanager
+    async def pooled_client(endpoint, api_key):  # pylint: disable=W0613
+        yield upstream
+
+    monkeypatch.setattr(utils.client_registry, 'client', pooled_client)
+    settings = IntegrationModel(
+        api_base='https://retry.example/v1', api_token='sk-test', model_name='gpt-4o', models=[],
+        rpm_limit=60, retry_deadline=0.6, max_retries=3,
+    )
+    keys = utils.api_keys(settings.endpoint_list, 1)
+
+    async def run():
+        limiter = ratelimit.get_limiter(settings.api_base, 'gpt-4o', 60, None)
+        for _ in range(59):  # one request left, the next one is a second away
+            await limiter.acquire(0)
+        started = time.monotonic()
+        with pytest.raises(openai.APIStatusError):
+            await utils._request(1, settings, 'chat', {'model': 'gpt-4o', 'messages': []}, keys)  # pylint: disable=W0212
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(run())
+    assert elapsed < 0.8
+    assert client.calls == 1
+    breaker = circuit_breakers.get(settings.api_base, 'gpt-4o').stats()
+    assert (breaker['requests'], breaker['failure_rate']) == (1, 1.0)
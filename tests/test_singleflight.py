@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from plugins.open_ai.singleflight import SingleFlight
+
+
+def test_followers_share_one_call_and_get_copies(fake_client):
+    async def run():
+        flight = SingleFlight()
+        client = fake_client(delay=0.01)
+        results = await asyncio.gather(*(flight.do('key', client.create) for _ in range(5)))
+        return flight, client, results
+
+    flight, client, results = asyncio.run(run())
+    assert client.calls == 1
+    assert flight.stats() == {'in_flight': 0, 'calls': 1, 'shared': 4}
+    assert all(result == results[0] for result in results)
+    results[1]['choices'].clear()
+    assert results[0]['choices']
+
+
+def test_leader_error_reaches_every_follower(fake_client):
+    async def run():
+        flight = SingleFlight()
+        client = fake_client(ValueError('upstream failed'), delay=0.01)
+        results = await asyncio.gather(
+            *(flight.do('key', client.create) for _ in range(3)), return_exceptions=True
+        )
+        return flight, client, results
+
+    flight, client, results = asyncio.run(run())
+    assert client.calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_failed_call_is_not_reused(fake_client):
+    async def run():
+        flight = SingleFlight()
+        client = fake_client(ValueError('upstream failed'))
+        with pytest.raises(ValueError):
+            await flight.do('key', client.create)
+        return await flight.do('key', client.create), client.calls
+
+    result, calls = asyncio.run(run())
+    assert result == {'choices': [{'text': 'hi'}]}
+    assert calls == 2
+
+
+def test_cancelled_follower_does_not_cancel_the_call(fake_client):
+    async def run():
+        flight = SingleFlight()
+        client = fake_client(delay=0.01)
+        leader = asyncio.ensure_future(flight.do('key', client.create))
+        follower = asyncio.ensure_future(flight.do('key', client.create))
+        await asyncio.sleep(0)
+        follower.cancel()
+        return await leader, client
+
+    result, client = asyncio.run(run())
+    assert result == {'choices': [{'text': 'hi'}]}
+    assert client.calls == 1
+    assert client.cancelled == 0
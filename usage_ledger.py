@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from pylon.core.tools import log
+
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'open_ai', 'usage.sqlite3')
+BUCKET_SECONDS = 60
+FIELDS = ('requests', 'prompt_tokens', 'completion_tokens', 'total_tokens')
+
+
+class UsageLedger:
+    """
+    Token usage per (minute, project_id, model, integration), aggregated in memory on the request path
+    and flushed to SQLite in bulk by a background thread. The integration is its primary api_base,
+    whichever of its endpoints served the call
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, flush_interval: float = 10.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flushes = 0
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._connection = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def configure(self, path: str | None = None, flush_interval: float | None = None):
+        self.close()
+        if path is not None:
+            self.path = path
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='open_ai-usage-ledger', daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS usage ('
+                'bucket INTEGER NOT NULL, project_id TEXT NOT NULL, model TEXT NOT NULL, integration TEXT NOT NULL, '
+                'requests INTEGER NOT NULL, prompt_tokens INTEGER NOT NULL, '
+                'completion_tokens INTEGER NOT NULL, total_tokens INTEGER NOT NULL, '
+                'PRIMARY KEY (bucket, project_id, model, integration)) WITHOUT ROWID'
+            )
+            self._connection = connection
+            log.info('Opened usage ledger at %s', self.path)
+        return self._connection
+
+    def record(self, project_id, model: str, integration: str, usage: dict | None):
+        """ Add one call's usage, memory only """
+        usage = usage or {}
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        completion_tokens = usage.get('completion_tokens') or 0
+        total_tokens = usage.get('total_tokens') or prompt_tokens + completion_tokens
+        bucket = int(time.time()) // BUCKET_SECONDS * BUCKET_SECONDS
+        key = (bucket, str(project_id), model, integration)
+        with self._pending_lock:
+            row = self._pending.get(key)
+            if row is None:
+                row = self._pending[key] = [0, 0, 0, 0]
+            row[0] += 1
+            row[1] += prompt_tokens
+            row[2] += completion_tokens
+            row[3] += total_tokens
+
+    def flush(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        rows = [(*key, *values) for key, values in pending.items()]
+        try:
+            self._write(rows)
+        except Exception:
+            self._restore(pending)
+            raise
+        self.flushes += 1
+
+    def _restore(self, pending: dict):
+        """ Merge unflushed rows back so a failed write loses nothing """
+        with self._pending_lock:
+            for key, values in pending.items():
+                row = self._pending.setdefault(key, [0, 0, 0, 0])
+                for index, value in enumerate(values):
+                    row[index] += value
+
+    def _write(self, rows: list):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    'INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (bucket, project_id, model, integration) DO UPDATE SET '
+                    'requests = requests + excluded.requests, '
+                    'prompt_tokens = prompt_tokens + excluded.prompt_tokens, '
+                    'completion_tokens = completion_tokens + excluded.completion_tokens, '
+                    'total_tokens = total_tokens + excluded.total_tokens',
+                    rows,
+                )
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=W0703
+                log.exception('Usage ledger flush failed')
+
+    def query(
+            self, project_id=None, model: str | None = None, integration: str | None = None,
+            since: float | None = None, until: float | None = None, granularity: int | None = None
+            ) -> list:
+        """ Usage summed per (project_id, model, integration), per `granularity` seconds window when given """
+        self.flush()
+        conditions, args = [], []
+        for column, value in (('project_id', project_id), ('model', model), ('integration', integration)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                args.append(str(value))
+        if since is not None:
+            conditions.append('bucket >= ?')
+            args.append(int(since) // BUCKET_SECONDS * BUCKET_SECONDS)
+        if until is not None:
+            conditions.append('bucket < ?')
+            args.append(int(until))
+        period = f'bucket / {int(granularity)} * {int(granularity)}' if granularity else 'NULL'
+        sql = (
+            f'SELECT {period} AS period, project_id, model, integration, '
+            f'{", ".join(f"SUM({field})" for field in FIELDS)} FROM usage '
+            f'{"WHERE " + " AND ".join(conditions) if conditions else ""} '
+            'GROUP BY period, project_id, model, integration ORDER BY period, project_id, model, integration'
+        )
+        with self._lock:
+            rows = self._connect().execute(sql, args).fetchall()
+        return [
+            {
+                **({'period': row[0]} if granularity else {}),
+                'project_id': row[1],
+                'model': row[2],
+                'integration': row[3],
+                **dict(zip(FIELDS, row[4:])),
+            }
+            for row in rows
+        ]
+
+    def close(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+
+    @property
+    def stats(self) -> dict:
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {
+            'path': self.path,
+            'pending': pending,
+            'flushes': self.flushes,
+        }
+
+
+usage_ledger = UsageLedger()
@@ -1,114 +1,205 @@
-from openai import ChatCompletion, Completion
-from collections import deque
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
 import tiktoken
+from . import hedging, metrics, ratelimit, runtime
+from .caches import LRUCache, TTLCache
+from .circuit import circuit_breakers
+from .clients import api_keys, client_registry
+from .endpoints import endpoint_pool
+from .model_registry import get_spec, response_reserve
 from .models.integration_pd import IntegrationModel
 from .models.request_body import ChatCompletionRequestBody, CompletionRequestBody
+from .retry import Deadline, DeadlineExceeded, call_with_retry
+from .response_cache import is_deterministic, make_key, response_cache
+from .singleflight import single_flight
+from .streams import stream_registry
+from .usage_ledger import usage_ledger
 from pylon.core.tools import log
 
 
-def init_openai(settings, project_id):
-    return {
-        'api_key': settings.api_token.unsecret(project_id),
-        'api_type': settings.api_type,
-        'api_version': settings.api_version,
-        'api_base': settings.api_base
-    }
-
-
-def num_tokens_from_messages(messages: list, model: str):
-    """Return the number of tokens used by a list of messages.
-    See: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_format_inputs_to_ChatGPT_models.ipynb
-    """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        log.warning("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model in {
-        "gpt-3.5-turbo-0613",
-        "gpt-3.5-turbo-16k-0613",
-        "gpt-4-0314",
-        "gpt-4-32k-0314",
-        "gpt-4-0613",
-        "gpt-4-32k-0613",
-        }:
-        tokens_per_message = 3
-        tokens_per_name = 1
-    elif model == "gpt-3.5-turbo-0301":
-        tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_name = -1  # if there's a name, the role is omitted
+TOKEN_CACHE_SIZE = 16384
+CONVERSATION_CACHE_SIZE = 1024
+CONVERSATION_IDLE_TTL = 1800
+
+_encodings = {}
+_message_formats = {}
+_message_tokens = LRUCache(maxsize=TOKEN_CACHE_SIZE)
+
+
+def get_encoding(model: str):
+    """ Process-wide tiktoken encoder registry """
+    encoding = _encodings.get(model)
+    if encoding is None:
+        spec = get_spec(model)
+        try:
+            if spec is not None:
+                encoding = tiktoken.get_encoding(spec.encoding)
+            else:
+                encoding = tiktoken.encoding_for_model(model)
+        except (KeyError, ValueError):
+            log.warning("Warning: model not found. Using cl100k_base encoding.")
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _encodings[model] = encoding
+    return encoding
+
+
+def get_message_format(model: str) -> tuple:
+    """ Resolve (encoding, tokens_per_message, tokens_per_name) for a model once """
+    message_format = _message_formats.get(model)
+    if message_format is not None:
+        return message_format
+    spec = get_spec(model)
+    if spec is not None:
+        message_format = (get_encoding(model), spec.tokens_per_message, spec.tokens_per_name)
     elif "gpt-3.5-turbo" in model:
-        log.warning("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613")
+        log.warning("Warning: unknown gpt-3.5-turbo model. Returning num tokens assuming gpt-3.5-turbo-0613.")
+        message_format = get_message_format("gpt-3.5-turbo-0613")
     elif "gpt-4" in model:
-        log.warning("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return num_tokens_from_messages(messages, model="gpt-4-0613")
+        log.warning("Warning: unknown gpt-4 model. Returning num tokens assuming gpt-4-0613.")
+        message_format = get_message_format("gpt-4-0613")
     else:
-        tokens_per_message = 4
-        tokens_per_name = -1
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
+        message_format = (get_encoding(model), 4, -1)
+    _message_formats[model] = message_format
+    return message_format
+
+
+def _message_digest(message: dict) -> bytes:
+    # a JSON encoding, so no content can pass for a field boundary
+    payload = json.dumps(message, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).digest()
+
+
+def count_message_tokens(message: dict, model: str) -> int:
+    """
+    Token count of a single message, memoized by content hash.
+    Raises TypeError for non-text fields (list content parts, tool call payloads) tiktoken can not encode
+    """
+    encoding, tokens_per_message, tokens_per_name = get_message_format(model)
+    cache_key = (encoding.name, tokens_per_message, tokens_per_name, _message_digest(message))
+    num_tokens = _message_tokens.get(cache_key)
+    if num_tokens is None:
+        num_tokens = tokens_per_message
         for key, value in message.items():
+            if value is None:  # e.g. assistant content next to tool calls
+                continue
             num_tokens += len(encoding.encode(value))
             if key == "name":
                 num_tokens += tokens_per_name
-    # num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+        _message_tokens.set(cache_key, num_tokens)
     return num_tokens
 
 
+def num_tokens_from_messages(messages: list, model: str):
+    """Return the number of tokens used by a list of messages.
+    See: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_format_inputs_to_ChatGPT_models.ipynb
+    """
+    with metrics.TOKEN_COUNT_SECONDS.time(model=model):
+        return sum(count_message_tokens(message, model) for message in messages)
+
+
+def is_known_model(model: str) -> bool:
+    """ The model's encoding is known, so local counts match what OpenAI bills """
+    if get_spec(model) is not None:
+        return True
+    try:
+        tiktoken.encoding_for_model(model)
+    except KeyError:
+        return False
+    return True
+
+
+def count_tokens(data, model: str):
+    """
+    Token count of a text or a message list, or per-item counts of a list of texts / message lists.
+    Message lists include the 3 tokens priming the reply, like LangChain's get_num_tokens_from_messages
+    """
+    with metrics.TOKEN_COUNT_SECONDS.time(model=model):
+        if isinstance(data, str):
+            return len(get_encoding(model).encode_ordinary(data))
+        if data and all(isinstance(item, str) for item in data):
+            return [len(tokens) for tokens in get_encoding(model).encode_ordinary_batch(data)]
+        if data and all(isinstance(item, list) for item in data):
+            return [sum(count_message_tokens(message, model) for message in item) + 3 for item in data]
+        return sum(count_message_tokens(message, model) for message in data) + 3
+
+
+def token_cache_stats() -> dict:
+    return {
+        'encodings': len(_encodings),
+        'messages': _message_tokens.stats,
+    }
+
+
+def clear_token_cache():
+    _message_tokens.clear()
+
+
+def cumulative_tokens(messages, model_name: str, budget: int | None = None) -> array:
+    """ Prefix sums of per-message token counts, stopping once the budget is exceeded """
+    totals = array('q')
+    total = 0
+    with metrics.TOKEN_COUNT_SECONDS.time(model=model_name):
+        for message in messages:
+            total += count_message_tokens(message, model_name)
+            totals.append(total)
+            if budget is not None and total > budget:
+                break
+    return totals
+
+
 def limit_conversation(
-        conversation: dict, model_name: str, max_response_tokens: int, token_limit: int
+        conversation: dict, model_name: str, max_response_tokens: int, token_limit: int,
+        history_window=None
         ) -> list:
-        limited_conversation = []
-        remaining_tokens = token_limit - max_response_tokens
+    """ history_window(remaining_tokens) -> index of the oldest history message that fits, if known """
+    with metrics.TRIM_SECONDS.time(model=model_name):
+        remaining_tokens = token_limit - response_reserve(model_name, max_response_tokens)
         remaining_tokens -= 3  # every reply is primed with <|start|>assistant<|message|>
 
-        context_tokens = num_tokens_from_messages(conversation['context'], model_name)
-        remaining_tokens -= context_tokens
-
+        remaining_tokens -= num_tokens_from_messages(conversation['context'], model_name)
         if remaining_tokens < 0:
             raise Exception(
 'There are no enough tokens to form messages for ChatCompletion. \
 Try using a lower value for the token limit parameter.'
-)
-
-        limited_conversation.extend(conversation['context'])
+            )
 
-        input_tokens = num_tokens_from_messages(conversation['input'], model_name)
-        remaining_tokens -= input_tokens
+        remaining_tokens -= num_tokens_from_messages(conversation['input'], model_name)
         if remaining_tokens < 0:
-            return limited_conversation
+            return list(conversation['context'])
 
-        final_examples = []
-        for example in conversation['examples']:
-            example_tokens = num_tokens_from_messages([example], model_name)
-            remaining_tokens -= example_tokens
-            if remaining_tokens < 0:
-                if len(final_examples) % 2:
-                    final_examples.pop()  # remove incomplete example if present
-                return limited_conversation + final_examples + conversation['input']
-            final_examples.append(example)
+        examples = conversation['examples']
+        examples_tokens = cumulative_tokens(examples, model_name, remaining_tokens)
+        examples_count = bisect_right(examples_tokens, remaining_tokens)
+        if examples_count < len(examples):
+            examples_count -= examples_count % 2  # remove incomplete example if present
+            return [*conversation['context'], *examples[:examples_count], *conversation['input']]
+        if examples_tokens:
+            remaining_tokens -= examples_tokens[-1]
 
-        limited_conversation.extend(final_examples)
+        # history is kept newest first, so prefix sums run over the reversed list
+        history = conversation['chat_history']
+        if history_window is not None:
+            history_start = history_window(remaining_tokens)
+        else:
+            history_tokens = cumulative_tokens(reversed(history), model_name, remaining_tokens)
+            history_start = len(history) - bisect_right(history_tokens, remaining_tokens)
 
-        final_history = deque()
-        for message in reversed(conversation['chat_history']):
-            message_tokens = num_tokens_from_messages([message], model_name)
-            remaining_tokens -= message_tokens
-            if remaining_tokens < 0:
-                return limited_conversation + list(final_history) + conversation['input']
-            final_history.appendleft(message)
-        limited_conversation.extend(final_history)
+        return [*conversation['context'], *examples, *history[history_start:], *conversation['input']]
 
-        limited_conversation.extend(conversation['input'])
-        return limited_conversation
 
+def history_message(message: dict) -> dict:
+    return {
+        "role": "user" if message['role'] == 'user' else "assistant",
+        "content": message['content']
+    }
 
-def prepare_conversation(
-        prompt_struct: dict, model_name: str, max_response_tokens: int, token_limit: int,
-        check_limits: bool = True
-        ) -> list:
+
+def build_conversation(prompt_struct: dict, with_history: bool = True) -> dict:
     conversation = {
         'context': [],
         'examples': [],
@@ -134,17 +225,22 @@ def prepare_conversation(
                     "name": "example_assistant",
                     "content": example['output']
                 })
-    if prompt_struct.get('chat_history'):
+    if with_history and prompt_struct.get('chat_history'):
         for message in prompt_struct['chat_history']:
-            conversation['chat_history'].append({
-                "role": "user" if message['role'] == 'user' else "assistant",
-                "content": message['content']
-            })
+            conversation['chat_history'].append(history_message(message))
     if prompt_struct.get('prompt'):
         conversation['input'].append({
             "role": "user",
             "content": prompt_struct['prompt']
         })
+    return conversation
+
+
+def prepare_conversation(
+        prompt_struct: dict, model_name: str, max_response_tokens: int, token_limit: int,
+        check_limits: bool = True
+        ) -> list:
+    conversation = build_conversation(prompt_struct)
 
     if check_limits:
         return limit_conversation(conversation, model_name, max_response_tokens, token_limit)
@@ -152,6 +248,82 @@ def prepare_conversation(
     return conversation['context'] + conversation['examples'] + conversation['chat_history'] + conversation['input']
 
 
+class Conversation:
+    """ Converted chat history of one session with prefix sums of its token counts, oldest first """
+    __slots__ = ('lock', 'model_name', 'source', 'history', 'offsets')
+
+    def __init__(self, model_name: str):
+        self.lock = threading.Lock()
+        self.reset(model_name)
+
+    def reset(self, model_name: str):
+        self.model_name = model_name
+        self.source = []
+        self.history = []
+        self.offsets = array('q', [0])
+
+    def sync(self, chat_history: list, model_name: str):
+        """ Count only messages appended since the last turn, any other change starts over """
+        known = len(self.source)
+        if model_name != self.model_name or len(chat_history) < known or chat_history[:known] != self.source:
+            self.reset(model_name)
+            known = 0
+        total = self.offsets[-1]
+        for message in chat_history[known:]:
+            # copies, so callers mutating their messages later cannot desync the counts
+            self.source.append(dict(message))
+            converted = history_message(message)
+            self.history.append(converted)
+            total += count_message_tokens(converted, model_name)
+            self.offsets.append(total)
+
+    def window(self, remaining_tokens: int) -> int:
+        """ Oldest history index whose suffix fits, the same cut the newest-first scan makes """
+        return bisect_left(self.offsets, self.offsets[-1] - remaining_tokens)
+
+
+class ConversationStore:
+    """ Session-scoped Conversations, least recently used and idle sessions are dropped """
+
+    def __init__(self, maxsize: int = CONVERSATION_CACHE_SIZE, idle_ttl: float = CONVERSATION_IDLE_TTL):
+        self._sessions = TTLCache(maxsize=maxsize, ttl=idle_ttl)
+
+    def configure(self, maxsize: int | None = None, idle_ttl: float | None = None):
+        self._sessions = TTLCache(
+            maxsize=self._sessions.maxsize if maxsize is None else maxsize,
+            ttl=self._sessions.ttl if idle_ttl is None else idle_ttl,
+        )
+
+    def prepare(
+            self, conversation_id: str, prompt_struct: dict, model_name: str, max_response_tokens: int,
+            token_limit: int
+            ) -> list:
+        """ prepare_conversation for one turn of a session, reusing history counts of earlier turns """
+        conversation = self._sessions.get(conversation_id)
+        if conversation is None:
+            conversation = Conversation(model_name)
+        self._sessions.set(conversation_id, conversation)  # restarts the idle timer
+        with conversation.lock:
+            conversation.sync(prompt_struct.get('chat_history') or [], model_name)
+            parts = build_conversation(prompt_struct, with_history=False)
+            parts['chat_history'] = conversation.history
+            return limit_conversation(
+                parts, model_name, max_response_tokens, token_limit, conversation.window
+            )
+
+    def close(self, conversation_id: str) -> bool:
+        return self._sessions.pop(conversation_id) is not None
+
+    def clear(self):
+        self._sessions.clear()
+
+    @property
+    def stats(self) -> dict:
+        return self._sessions.stats
+
+
+conversations = ConversationStore()
+
 
 def prerare_text_prompt(prompt_struct):
     example_template = '\ninput: {input}\noutput: {output}'
@@ -195,32 +367,214 @@ def prepare_result(content):
     return structured_result
 
 
-def predict_chat(project_id: int, settings: dict, prompt_struct: dict) -> str:
-    settings = IntegrationModel.parse_obj(settings)
-    init_settings = init_openai(settings, project_id)
+def _in_flight_limit(settings: IntegrationModel, project_id: int, endpoint=None):
+    api_base = (endpoint or settings).api_base
+    return runtime.in_flight_limit((project_id, api_base), settings.max_in_flight)
+
+
+def _create(kind: str, params: dict):
+    if kind == 'chat':
+        return lambda client: client.chat.completions.create(**params)
+    return lambda client: client.completions.create(**params)
 
-    token_limit = settings.token_limit
-    conversation = prepare_conversation(
-        prompt_struct, settings.model_name, settings.max_tokens, token_limit)
 
-    response = ChatCompletion.create(
-        model=settings.model_name,
-        temperature=settings.temperature,
-        max_tokens=settings.max_tokens,
-        top_p=settings.top_p,
-        messages=conversation,
-        **init_settings
+def estimate_tokens(kind: str, params: dict) -> int:
+    """ Prompt tokens plus the requested completion budget """
+    model = params['model']
+    try:
+        if kind == 'chat':
+            prompt_tokens = num_tokens_from_messages(params.get('messages') or [], model)
+        else:
+            prompts = params.get('prompt') or ''
+            if isinstance(prompts, str):
+                prompts = [prompts]
+            encoding = get_encoding(model)
+            prompt_tokens = sum(len(encoding.encode_ordinary(prompt)) for prompt in prompts)
+    except (TypeError, ValueError):
+        # function calls and other non-text values, roughly 4 characters per token
+        prompt_tokens = len(json.dumps(params.get('messages') or params.get('prompt'), default=str)) // 4
+    return prompt_tokens + (params.get('max_tokens') or 0)
+
+
+async def _rate_limit(settings: IntegrationModel, endpoint, model: str, tokens: int, priority: str):
+    limiter = ratelimit.get_limiter(endpoint.api_base, model, settings.rpm_limit, settings.tpm_limit)
+    if limiter is not None:
+        waited = await limiter.acquire(tokens, priority)
+        if waited:
+            log.info('Rate limited %s for %.2fs', model, waited)
+
+
+async def _request(
+        project_id: int, settings: IntegrationModel, kind: str, params: dict, keys: dict,
+        priority: str = 'interactive', tokens: int = 0, avoid: set | None = None
+        ) -> dict:
+    failed = set()
+    # the retry budget starts once the rate limiter admits the first attempt, queueing there is not a timeout.
+    # Attempts time out inside the guards, so circuit breaker and endpoint pool count a hung call as a failure
+    deadline = Deadline(settings.retry_deadline, lazy=True)
+
+    async def attempt():
+        # every attempt picks an endpoint, preferring ones that have not failed this call yet
+        # and ones not taken by a concurrent hedge of the same request (shared `avoid`)
+        endpoints = circuit_breakers.available(settings.endpoint_list, params['model'])
+        endpoint = endpoint_pool.select(endpoints, settings.balancing, tuple(failed | (avoid or set())))
+        if avoid is not None:
+            avoid.add(endpoint_pool.key(endpoint))
+        if deadline.at is None:
+            await _rate_limit(settings, endpoint, params['model'], tokens, priority)
+            deadline.start()
+        else:
+            # a retry that can not be admitted in time gives up with the previous error, not a timeout of its own
+            try:
+                await asyncio.wait_for(
+                    _rate_limit(settings, endpoint, params['model'], tokens, priority), max(deadline.remaining, 0.0)
+                )
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded() from None
+        async with _in_flight_limit(settings, project_id, endpoint), \
+                client_registry.client(endpoint, keys[endpoint_pool.key(endpoint)]) as client:
+            if deadline.remaining <= 0:
+                raise DeadlineExceeded()
+            started = time.perf_counter()
+            try:
+                with circuit_breakers.guard(endpoint.api_base, params['model']), endpoint_pool.track(endpoint):
+                    response = await asyncio.wait_for(_create(kind, params)(client), deadline.remaining)
+            except Exception:
+                failed.add(endpoint_pool.key(endpoint))
+                metrics.UPSTREAM_SECONDS.observe(
+                    time.perf_counter() - started, model=params['model'], kind=kind, outcome='error'
+                )
+                raise
+        metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - started, model=params['model'], kind=kind, outcome='ok')
+        response = response.model_dump()
+        metrics.record_usage(project_id, params['model'], response.get('usage'))
+        usage_ledger.record(project_id, params['model'], settings.api_base, response.get('usage'))
+        return response
+
+    return await call_with_retry(
+        attempt, settings.max_retries, deadline, label=f"{kind} {params['model']}", bound_attempts=False,
     )
 
-    content = response['choices'][0]['message']['content']
 
-    return prepare_result(content)
+async def _send(
+        project_id: int, settings: IntegrationModel, kind: str, params: dict, keys: dict,
+        priority: str = 'interactive', tokens: int = 0
+        ) -> dict:
+    if kind != 'chat' or not settings.hedge_requests or priority != 'interactive':
+        return await _request(project_id, settings, kind, params, keys, priority, tokens)
+    avoid = set() if settings.hedge_other_endpoint else None
+    return await hedging.hedged(
+        lambda: _request(project_id, settings, kind, params, keys, priority, tokens, avoid),
+        hedging.get_hedger(params['model']), settings.hedge_percentile, settings.hedge_budget,
+    )
 
 
-def predict_chat_from_request(project_id: int, settings: dict, request_data: dict) -> str:
+async def _stream_response(
+        project_id: int, settings: IntegrationModel, kind: str, params: dict, keys: dict,
+        priority: str = 'interactive', tokens: int = 0
+        ):
+    """ Yield chunks of a stream=True call, holding the in-flight slot until the stream ends """
+    endpoints = circuit_breakers.available(settings.endpoint_list, params['model'])
+    endpoint = endpoint_pool.select(endpoints, settings.balancing)
+    await _rate_limit(settings, endpoint, params['model'], tokens, priority)
+    async with _in_flight_limit(settings, project_id, endpoint), \
+            client_registry.client(endpoint, keys[endpoint_pool.key(endpoint)]) as client:
+        deadline_at = time.monotonic() + settings.retry_deadline
+
+        async def open_stream():
+            with circuit_breakers.guard(endpoint.api_base, params['model']), endpoint_pool.track(endpoint):
+                return await asyncio.wait_for(
+                    _create(kind, params)(client), max(deadline_at - time.monotonic(), 0.0)
+                )
+
+        # only opening the stream is retried, chunks already handed out cannot be replayed
+        response = await call_with_retry(
+            open_stream, settings.max_retries, settings.retry_deadline,
+            label=f"{kind} {params['model']} stream", bound_attempts=False,
+        )
+        async for chunk in response:
+            chunk = chunk.model_dump()
+            if chunk.get('usage'):
+                # only sent as the last chunk with stream_options={'include_usage': True}
+                metrics.record_usage(project_id, params['model'], chunk['usage'])
+                usage_ledger.record(project_id, params['model'], settings.api_base, chunk['usage'])
+            yield chunk
+
+
+async def complete(
+        project_id: int, settings: IntegrationModel, kind: str, params: dict, keys: dict,
+        priority: str = 'interactive', tokens: int = 0, key: str | None = None
+        ):
+    """
+    Single entry point for upstream chat ('chat') and text ('text') completions on the shared loop.
+    keys (api keys by endpoint), tokens (rate limit estimate) and key (response cache / coalescing key)
+    are computed off the loop by `call`
+    """
+    if params.get('stream'):
+        return stream_registry.open(_stream_response(project_id, settings, kind, params, keys, priority, tokens))
+    if key is None:
+        return await _send(project_id, settings, kind, params, keys, priority, tokens)
+    if settings.response_cache:
+        response = await response_cache.get(key)
+        if response is not None:
+            return response
+
+    async def fetch():
+        response = await _send(project_id, settings, kind, params, keys, priority, tokens)
+        if settings.response_cache:
+            await response_cache.set(key, response, settings.response_cache_ttl)
+        return response
+
+    if settings.coalesce_requests:
+        return await single_flight.do(key, fetch)
+    return await fetch()
+
+
+def call(
+        project_id: int, settings: IntegrationModel, kind: str, params: dict, priority: str = 'interactive'
+        ):
+    """ Block on `complete`, unsecreting, tokenizing and hashing in the calling thread so the loop only does I/O """
+    keys = api_keys(settings.endpoint_list, project_id)
+    tokens = estimate_tokens(kind, params) if settings.tpm_limit else 0
+    key = None
+    if is_deterministic(params) and (settings.response_cache or settings.coalesce_requests):
+        key = make_key(project_id, settings.api_base, kind, params)
+    return runtime.run(complete(project_id, settings, kind, params, keys, priority, tokens, key))
+
+
+def chat_params(settings: IntegrationModel, prompt_struct: dict) -> dict:
+    """ chat.completions parameters of a prompt_struct, conversation trimmed to the token limit """
+    if prompt_struct.get('conversation_id') is not None:
+        conversation = conversations.prepare(
+            prompt_struct['conversation_id'], prompt_struct, settings.model_name, settings.max_tokens,
+            settings.token_limit)
+    else:
+        conversation = prepare_conversation(
+            prompt_struct, settings.model_name, settings.max_tokens, settings.token_limit)
+
+    return {
+        'model': settings.model_name,
+        'temperature': settings.temperature,
+        'max_tokens': settings.max_tokens,
+        'top_p': settings.top_p,
+        'messages': conversation,
+    }
+
+
+def text_params(settings: IntegrationModel, prompt_struct: dict) -> dict:
+    """ completions parameters of a prompt_struct """
+    return {
+        'model': settings.model_name,
+        'temperature': settings.temperature,
+        'max_tokens': settings.max_tokens,
+        'top_p': settings.top_p,
+        'prompt': prerare_text_prompt(prompt_struct),
+    }
+
+
+def chat_request_params(settings: IntegrationModel, request_data: dict) -> dict:
+    """ Validated chat.completions request body, messages trimmed to the token limit """
     params = ChatCompletionRequestBody.validate(request_data).dict(exclude_unset=True)
-    settings = IntegrationModel.parse_obj(settings)
-    init_settings = init_openai(settings, project_id)
 
     token_limit = settings.get_token_limit(params['model'])
     max_tokens = params.get('max_tokens', 0)
@@ -228,30 +582,49 @@ def predict_chat_from_request(project_id: int, settings: dict, request_data: dic
         params['messages'] = limit_messages(
             params['messages'], params['model'], max_tokens, token_limit
             )
+    return params
 
-    return ChatCompletion.create(**params, **init_settings)
 
+def completion_request_params(settings: IntegrationModel, request_data: dict) -> dict:
+    return CompletionRequestBody.validate(request_data).dict(exclude_unset=True)
 
-def predict_from_request(project_id: int, settings: dict, request_data: dict) -> str:
-    params = CompletionRequestBody.validate(request_data).dict(exclude_unset=True)
-    settings = IntegrationModel.parse_obj(settings)
-    init_settings = init_openai(settings, project_id)
-    return Completion.create(**params, **init_settings)
 
+def predict_chat(
+        project_id: int, settings: dict, prompt_struct: dict, priority: str = 'interactive'
+        ) -> dict:
+    settings = IntegrationModel.parse_cached(settings)
+    params = chat_params(settings, prompt_struct)
+    response = call(project_id, settings, 'chat', params, priority)
 
-def predict_text(project_id: int, settings: dict, prompt_struct: dict) -> str:
-    settings = IntegrationModel.parse_obj(settings)
-    init_settings = init_openai(settings, project_id)
-    text_prompt = prerare_text_prompt(prompt_struct)
+    content = response['choices'][0]['message']['content']
 
-    response = Completion.create(
-        model=settings.model_name,
-        temperature=settings.temperature,
-        max_tokens=settings.max_tokens,
-        top_p=settings.top_p,
-        prompt=text_prompt,
-        **init_settings
-    )
+    return prepare_result(content)
+
+
+def predict_chat_from_request(
+        project_id: int, settings: dict, request_data: dict, priority: str = 'interactive'
+        ):
+    settings = IntegrationModel.parse_cached(settings)
+    params = chat_request_params(settings, request_data)
+
+    return call(project_id, settings, 'chat', params, priority)
+
+
+def predict_from_request(
+        project_id: int, settings: dict, request_data: dict, priority: str = 'interactive'
+        ):
+    settings = IntegrationModel.parse_cached(settings)
+    params = completion_request_params(settings, request_data)
+
+    return call(project_id, settings, 'text', params, priority)
+
+
+def predict_text(
+        project_id: int, settings: dict, prompt_struct: dict, priority: str = 'interactive'
+        ) -> dict:
+    settings = IntegrationModel.parse_cached(settings)
+    params = text_params(settings, prompt_struct)
+    response = call(project_id, settings, 'text', params, priority)
 
     content = response['choices'][0]['text']
     log.info('completion_response %s', content)
@@ -0,0 +1,18 @@
+"""
+Token counting pool worker. Pool processes import it as a top-level module from this directory,
+not through plugins.open_ai whose package init needs the pylon runtime, so it imports tiktoken and the stdlib only
+"""
+from array import array
+
+import tiktoken
+
+
+def load_encoding(encoding_name: str):
+    """ Pool initializer, BPE ranks are loaded once per worker instead of on its first chunk """
+    tiktoken.get_encoding(encoding_name)
+
+
+def count_chunk(encoding_name: str, texts: list) -> bytes:
+    encoding = tiktoken.get_encoding(encoding_name)
+    # one process per core already, encode_ordinary_batch's thread pool would only add per-text overhead
+    return array('I', map(len, map(encoding.encode_ordinary, texts))).tobytes()